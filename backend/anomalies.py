@@ -0,0 +1,322 @@
+"""Incremental detection of abnormal changes between consecutive measurements.
+
+Each measurement is compared with the previous value of the same device. The
+change is scored against what is normal for the device at that hour of the
+day: an exponentially weighted mean and variance of its changes, learned per
+(device, UTC hour) so that daily cycles such as sunrise on the luminosity
+sensors are not reported. A change is abnormal when it lies more than
+`ANOMALY_Z_THRESHOLD` standard deviations from the mean. Until a slot has
+seen `ANOMALY_MIN_SAMPLES` changes, the fixed threshold of the sensor
+registry applies; it also bounds how tight a learned band can get.
+
+Rows are scored with NumPy in large chunks: the slots are updated together,
+one change each per step, so the cost grows with the number of changes per
+slot rather than with the number of rows. The model, the last value per
+device and a high-water mark (the last Measurements id checked) are
+persisted in the database, so a check only reads the rows inserted since the
+previous one. Detected changes are stored in Anomalies and reported in
+Errors.
+
+After a bulk load or to re-score history with new settings:
+
+    python anomalies.py --backfill
+"""
+import argparse
+import os
+import time
+
+import numpy
+
+import db
+from errors import record_errors
+from sensors import NIGHT_THRESHOLDS, THRESHOLDS
+
+HIGH_WATER_KEY = 'anomaly_high_water'
+FETCH_SIZE = 100000
+
+SLOTS = 24
+SLOT_WIDTH = 3600
+
+# Number of changes of a slot the mean and variance mostly reflect
+EWMA_SPAN = int(os.environ.get('ANOMALY_EWMA_SPAN', '60'))
+Z_THRESHOLD = float(os.environ.get('ANOMALY_Z_THRESHOLD', '5'))
+MIN_SAMPLES = int(os.environ.get('ANOMALY_MIN_SAMPLES', '12'))
+# Narrowest learned band, as a fraction of the registry threshold: keeps
+# steady sensors from reporting their rounding steps
+MIN_BAND = float(os.environ.get('ANOMALY_MIN_BAND', '0.25'))
+
+ALPHA = 2 / (EWMA_SPAN + 1)
+
+
+class AnomalyDetector:
+    """Stateful detector, resumed from the state persisted in the database.
+
+    `catch_up` must run inside a write transaction. Several processes may
+    share the database: the in-memory state is reloaded whenever another
+    process moved the high-water mark.
+
+    State is kept in arrays indexed by device id (last values, registry
+    thresholds) and by slot, `device * SLOTS + hour` (model).
+    """
+
+    def __init__(self):
+        self.high_water = None
+        self._allocate(0)
+
+    def _allocate(self, devices):
+        self.known = numpy.zeros(devices, bool)
+        self.thresholds = numpy.full(devices, numpy.nan)
+        self.night_values = numpy.full(devices, numpy.nan)
+        self.night_thresholds = numpy.full(devices, numpy.nan)
+        self.last_values = numpy.full(devices, numpy.nan)
+        self.counts = numpy.zeros(devices * SLOTS, numpy.int64)
+        self.means = numpy.zeros(devices * SLOTS)
+        self.variances = numpy.zeros(devices * SLOTS)
+
+    def _grow(self, devices):
+        """Make room for device ids below `devices`, keeping the state."""
+        size = len(self.known)
+        if devices <= size:
+            return
+        devices = max(devices, 2 * size)
+        for name in ('known', 'thresholds', 'night_values', 'night_thresholds', 'last_values'):
+            old = getattr(self, name)
+            new = numpy.full(devices, False if old.dtype == bool else numpy.nan, old.dtype)
+            new[:size] = old
+            setattr(self, name, new)
+        for name in ('counts', 'means', 'variances'):
+            old = getattr(self, name)
+            new = numpy.zeros(devices * SLOTS, old.dtype)
+            new[:size * SLOTS] = old
+            setattr(self, name, new)
+
+    def load_devices(self, c):
+        """Registry thresholds of every device (NaN: not checked)."""
+        rows = c.execute("SELECT id, type FROM Device").fetchall()
+        self._grow(max((row[0] for row in rows), default=-1) + 1)
+        for device, device_type in rows:
+            self.known[device] = True
+            self.thresholds[device] = THRESHOLDS.get(device_type, numpy.nan)
+            self.night_values[device], self.night_thresholds[device] = NIGHT_THRESHOLDS.get(
+                device_type, (numpy.nan, numpy.nan)
+            )
+
+    def load(self, c):
+        self._allocate(0)
+        self.load_devices(c)
+        for device, value in c.execute("SELECT device, value FROM AnomalyState"):
+            self._grow(device + 1)
+            self.last_values[device] = numpy.nan if value is None else value
+        for device, slot, count, mean, variance in c.execute(
+            "SELECT device, slot, count, mean, variance FROM AnomalyModel"
+        ):
+            self._grow(device + 1)
+            slot = device * SLOTS + slot
+            self.counts[slot], self.means[slot], self.variances[slot] = count, mean, variance
+        self.high_water = c.execute("SELECT value FROM Meta WHERE key = ?", (HIGH_WATER_KEY,)).fetchone()[0]
+
+    def catch_up(self, c, report=True):
+        """Check every measurement newer than the high-water mark.
+
+        With `report=False` the abnormal changes are stored in Anomalies but
+        not in Errors (backfill). Returns the number of abnormal changes found.
+        """
+        stored = c.execute("SELECT value FROM Meta WHERE key = ?", (HIGH_WATER_KEY,)).fetchone()[0]
+        if stored != self.high_water:
+            self.load(c)
+        try:
+            return self._process_new_rows(c, report)
+        except BaseException:
+            # The transaction will be rolled back: drop the in-memory state
+            self.high_water = None
+            raise
+
+    def _process_new_rows(self, c, report):
+        cursor = c.execute(
+            "SELECT id, device, value, recorded_ts FROM Measurements WHERE id > ? ORDER BY id",
+            (self.high_water,)
+        )
+        anomalies = []
+        states = {}
+        slots = set()
+        high_water = self.high_water
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            # None values become NaN
+            ids, devices, values, timestamps = numpy.array(rows, float).T
+            ids = ids.astype(numpy.int64)
+            devices = devices.astype(numpy.int64)
+            self._grow(devices.max() + 1)
+            if not self.known[devices].all():
+                self.load_devices(c)
+
+            previous = self._previous_values(devices, values)
+            for device, value, measurement in zip(*self._last_rows(ids, devices, values)):
+                states[device] = (None if value != value else value, measurement)
+            timestamps = numpy.nan_to_num(timestamps).astype(numpy.int64)
+            found, touched = self._score(ids, devices, values, timestamps, previous)
+            anomalies.extend(found)
+            slots.update(touched)
+            high_water = int(ids[-1])
+
+        if high_water == self.high_water:
+            return 0
+
+        c.executemany(
+            """INSERT INTO Anomalies (device, measurement, previous_value, current_value, difference, threshold, recorded_ts)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            anomalies
+        )
+        if report:
+            errors = []
+            for device, _, previous, value, diff, threshold, recorded_ts in anomalies:
+                recorded_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(recorded_ts))
+                errors.append((device, f"Abnormal change detected: {previous} to {value} (diff: {diff}, threshold: {threshold})",
+                               recorded_at, recorded_at, 1))
+            record_errors(c, errors)
+        c.executemany(
+            "INSERT OR REPLACE INTO AnomalyState (device, value, measurement) VALUES (?, ?, ?)",
+            [(device, value, measurement) for device, (value, measurement) in states.items()]
+        )
+        slots = sorted(slots)
+        c.executemany(
+            "INSERT OR REPLACE INTO AnomalyModel (device, slot, count, mean, variance) VALUES (?, ?, ?, ?, ?)",
+            [(slot // SLOTS, slot % SLOTS, int(self.counts[slot]), float(self.means[slot]), float(self.variances[slot]))
+             for slot in slots]
+        )
+        c.execute("UPDATE Meta SET value = ? WHERE key = ?", (high_water, HIGH_WATER_KEY))
+        self.high_water = high_water
+        return len(anomalies)
+
+    def _previous_values(self, devices, values):
+        """Value of the row before each row of the same device, and remember the last ones."""
+        order = numpy.argsort(devices, kind='stable')
+        sorted_devices = devices[order]
+        sorted_values = values[order]
+        first = numpy.ones(len(order), bool)
+        first[1:] = sorted_devices[1:] != sorted_devices[:-1]
+        previous = numpy.empty(len(order))
+        previous[1:] = sorted_values[:-1]
+        previous[first] = self.last_values[sorted_devices[first]]
+        last = numpy.append(first[1:], True)
+        self.last_values[sorted_devices[last]] = sorted_values[last]
+        result = numpy.empty(len(order))
+        result[order] = previous
+        return result
+
+    @staticmethod
+    def _last_rows(ids, devices, values):
+        """(devices, values, ids) of the last row of each device."""
+        _, last = numpy.unique(devices[::-1], return_index=True)
+        last = len(devices) - 1 - last
+        return devices[last].tolist(), values[last].tolist(), ids[last].tolist()
+
+    def _score(self, ids, devices, values, timestamps, previous):
+        """Abnormal changes among rows ordered by id, updating the model.
+
+        Returns (Anomalies rows, slots updated).
+        """
+        changes = values - previous
+        night = values < self.night_values[devices]
+        thresholds = numpy.where(night, self.night_thresholds[devices], self.thresholds[devices])
+        checked = numpy.flatnonzero(~numpy.isnan(changes) & ~numpy.isnan(thresholds))
+        if not len(checked):
+            return [], []
+
+        slots = devices[checked] * SLOTS + timestamps[checked] // SLOT_WIDTH % SLOTS
+        # Changes of a slot in id order, then the rank of each within its slot
+        order = numpy.argsort(slots, kind='stable')
+        sorted_slots = slots[order]
+        starts = numpy.ones(len(order), bool)
+        starts[1:] = sorted_slots[1:] != sorted_slots[:-1]
+        positions = numpy.arange(len(order))
+        ranks = positions - numpy.maximum.accumulate(numpy.where(starts, positions, 0))
+        # Step r scores the r-th change of every slot at once
+        by_rank = numpy.argsort(ranks, kind='stable')
+        bounds = numpy.searchsorted(ranks[by_rank], numpy.arange(ranks.max() + 2))
+        rows = checked[order[by_rank]]
+        row_slots = sorted_slots[by_rank]
+
+        flagged = numpy.zeros(len(rows), bool)
+        limits = numpy.empty(len(rows))
+        for step in range(len(bounds) - 1):
+            part = slice(bounds[step], bounds[step + 1])
+            slot = row_slots[part]
+            change = changes[rows[part]]
+            threshold = thresholds[rows[part]]
+            count = self.counts[slot]
+            mean = self.means[slot]
+            variance = self.variances[slot]
+
+            learned = count >= MIN_SAMPLES
+            band = numpy.where(learned, numpy.maximum(Z_THRESHOLD * numpy.sqrt(variance), MIN_BAND * threshold), threshold)
+            center = numpy.where(learned, mean, 0.0)
+            flagged[part] = numpy.abs(change - center) > band
+            # Largest normal change in the direction of this one, comparable
+            # with the absolute difference
+            limits[part] = numpy.abs(center + numpy.sign(change) * band)
+
+            # Outliers are clipped so that they do not widen the band
+            clipped = numpy.clip(change, center - band, center + band)
+            alpha = numpy.maximum(ALPHA, 1.0 / (count + 1))
+            delta = clipped - mean
+            self.means[slot] = mean + alpha * delta
+            self.variances[slot] = (1 - alpha) * (variance + alpha * delta * delta)
+            self.counts[slot] = count + 1
+
+        found = numpy.flatnonzero(flagged)
+        found = found[numpy.argsort(rows[found])]
+        anomalies = [
+            (device, measurement, prev, value, round(abs(value - prev), 2), round(limit, 2), ts)
+            for device, measurement, prev, value, limit, ts in zip(
+                devices[rows[found]].tolist(), ids[rows[found]].tolist(), previous[rows[found]].tolist(),
+                values[rows[found]].tolist(), limits[found].tolist(), timestamps[rows[found]].tolist(),
+            )
+        ]
+        return anomalies, numpy.unique(slots).tolist()
+
+
+def backfill(c):
+    """Score the whole history again from an empty model.
+
+    Abnormal changes of the history are stored in Anomalies, without adding
+    Errors. Returns the number found.
+    """
+    c.execute("DELETE FROM Anomalies")
+    c.execute("DELETE FROM AnomalyModel")
+    c.execute("DELETE FROM AnomalyState")
+    c.execute("UPDATE Meta SET value = 0 WHERE key = ?", (HIGH_WATER_KEY,))
+    return AnomalyDetector().catch_up(c, report=False)
+
+
+def recent_anomalies(c, since_ts):
+    """Abnormal changes recorded since `since_ts`, oldest first."""
+    return c.execute("""
+        SELECT a.device, d.type AS device_type, a.previous_value, a.current_value,
+               a.difference, a.threshold, a.recorded_ts
+        FROM Anomalies a
+        JOIN Device d ON a.device = d.id
+        WHERE a.recorded_ts >= ?
+        ORDER BY a.id
+    """, (since_ts,)).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backfill', action='store_true', help="score the whole history again from an empty model")
+    args = parser.parse_args()
+    if not args.backfill:
+        parser.error("nothing to do")
+    try:
+        started = time.perf_counter()
+        with db.get_writer().transaction() as c:
+            found = backfill(c)
+        print(f"Backfill: {found} abnormal changes in {time.perf_counter() - started:.1f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Benchmark the hot queries before and after the schema migrations.
+
+Builds a throwaway database with the original schema, fills it with N
+measurements spread over the sensors, times the queries used by the API and
+the MQTT ingest, then runs `migrations.migrate` and times them again:
+
+    python bench_indexes.py --rows 1000000 10000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import prod_db_generator
+from migrations import migrate
+
+DEVICES = 11
+SAMPLE_INTERVAL = 60  # seconds between two rows of the synthetic dataset
+BATCH_SIZE = 100000
+
+# (name, query before migration, query after migration, parameters)
+QUERIES = [
+    (
+        "series co2, last 7 days",
+        """SELECT m.value, m.recorded_at FROM Measurements m JOIN Device d ON m.device = d.id
+           WHERE d.type = 'co2' AND m.recorded_at >= datetime('now', '-7 days')""",
+        """SELECT m.value, m.recorded_at FROM Measurements m JOIN Device d ON m.device = d.id
+           WHERE d.type = 'co2' AND m.recorded_ts >= CAST(strftime('%s', 'now') AS INTEGER) - 7 * 86400""",
+        (),
+    ),
+    (
+        "abnormal check, last 24 hours",
+        """SELECT m.device, m.value, m.recorded_at, d.type FROM Measurements m JOIN Device d ON m.device = d.id
+           WHERE m.recorded_at >= datetime('now', '-1 day') ORDER BY d.type, m.recorded_at""",
+        """SELECT m.device, m.value, m.recorded_at, d.type FROM Measurements m JOIN Device d ON m.device = d.id
+           WHERE m.recorded_ts >= CAST(strftime('%s', 'now') AS INTEGER) - 86400 ORDER BY d.type, m.recorded_ts""",
+        (),
+    ),
+    (
+        "ingest error dedup",
+        "SELECT COUNT(*) FROM Errors WHERE device = ? AND error = ?",
+        "SELECT COUNT(*) FROM Errors WHERE device = ? AND error = ?",
+        (8, "Value 6000 out of range (0-5000) for CO2 level"),
+    ),
+]
+
+
+def fill(conn, rows):
+    """Insert `rows` measurements ending now, plus one error per 1000 rows."""
+    now = int(time.time())
+    start = now - rows * SAMPLE_INTERVAL // DEVICES
+    for offset in range(0, rows, BATCH_SIZE):
+        batch = []
+        for i in range(offset, min(offset + BATCH_SIZE, rows)):
+            ts = start + i * SAMPLE_INTERVAL // DEVICES
+            batch.append((i % DEVICES + 1, round(random.uniform(0, 100), 2),
+                          time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts))))
+        conn.executemany("INSERT INTO Measurements (device, value, recorded_at) VALUES (?, ?, ?)", batch)
+    conn.executemany(
+        "INSERT INTO Errors (device, error) VALUES (?, ?)",
+        [(random.randint(1, DEVICES), f"dummy error {i}") for i in range(rows // 1000)],
+    )
+    conn.commit()
+
+
+def time_query(conn, query, params, repeat):
+    """Best wall time of `repeat` runs, in milliseconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(query, params).fetchall()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run(rows, repeat):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(path)
+        c = conn.cursor()
+        prod_db_generator.create_tables(c)
+        prod_db_generator.init_capteurs(c)
+        fill(conn, rows)
+
+        before = [time_query(conn, q, p, repeat) for _, q, _, p in QUERIES]
+        start = time.perf_counter()
+        migrate(conn)
+        migration_time = time.perf_counter() - start
+        after = [time_query(conn, q, p, repeat) for _, _, q, p in QUERIES]
+        conn.close()
+    finally:
+        os.remove(path)
+
+    print(f"\n{rows:,} rows (migration took {migration_time:.1f} s)")
+    print(f"{'query':<32}{'before (ms)':>14}{'after (ms)':>14}")
+    for (name, _, _, _), b, a in zip(QUERIES, before, after):
+        print(f"{name:<32}{b:>14.2f}{a:>14.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000, 10000000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    for rows in args.rows:
+        run(rows, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
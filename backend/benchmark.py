@@ -0,0 +1,200 @@
+"""End-to-end benchmark: dataset generation, ingest replay and HTTP load.
+
+1. Generates a realistic multi-station history in a throwaway database with
+   `dev_db_generator.add_history`.
+2. Replays MQTT uplinks through `mqtt_adder.handle_message`, the queue and
+   the batch writer, as fast as they are accepted.
+3. Starts the API on that database and fires concurrent clients at every GET
+   route, once with the response cache and once bypassing it.
+
+Throughput and latencies are written to a JSON report; `--compare` prints
+the change of each number against a previous report:
+
+    python benchmark.py --days 730 --stations 3 --output bench-new.json --compare bench-old.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Every GET route of server.py except /stream, with the parameters the
+# dashboards use
+BENCH_ROUTES = [
+    "/temperatures-humidity",
+    "/soil-humidity",
+    "/luminosity",
+    "/co2",
+    "/pressure",
+    "/battery",
+    "/temperaturesol",
+    "/errors",
+    "/summary",
+    "/check-abnormal-measurements",
+    "/measurements?types=temperature,humidity,co2,pressure",
+    "/co2?bucket=1h&agg=avg",
+    "/temperatures-humidity?points=500",
+    "/battery?limit=100&time_format=epoch_ms",
+    "/metrics",
+    "/cache/stats",
+]
+
+
+def generate(db_path, days, stations, interval):
+    import dev_db_generator as generator
+
+    conn, c = generator.connect_db(db_path)
+    generator.create_tables(c)
+    generator.init_capteurs(c)
+    conn.commit()
+    generator.migrate(conn)
+    start = time.perf_counter()
+    rows = generator.add_history(conn, days, stations, interval)
+    generator.add_dummy_errors(c, 100)
+    conn.commit()
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return {"rows": rows, "seconds": round(elapsed, 2), "rows_per_s": round(rows / elapsed),
+            "db_mb": round(os.path.getsize(db_path) / 1e6, 1)}
+
+
+def replay(uplinks, stations):
+    """Push MQTT-style messages through the ingest path and wait for the writer."""
+    import dev_db_generator as generator
+    import mqtt_adder
+
+    names = [mqtt_adder.device_id] + [f"station-{i}" for i in range(1, stations)]
+    messages = [(f"v3/{mqtt_adder.app_id}@ttn/devices/{station}/up", payload)
+                for station, payload in generator.uplink_messages(names, int(time.time()), uplinks)]
+
+    mqtt_adder.start_ingest()
+    start = time.perf_counter()
+    for topic, payload in messages:
+        mqtt_adder.handle_message(topic, json.dumps(payload).encode(), block=True)
+    mqtt_adder.stop_ingest()
+    elapsed = time.perf_counter() - start
+
+    batches = mqtt_adder.BATCHES.value(outcome='ok')
+    batch_seconds = sum(value for name, _, value in mqtt_adder.BATCH_SECONDS.samples() if name.endswith('_sum'))
+    return {
+        "uplinks": len(messages),
+        "seconds": round(elapsed, 2),
+        "uplinks_per_s": round(len(messages) / elapsed),
+        "measurements": mqtt_adder.MEASUREMENTS.value(),
+        "batches": batches,
+        "failed_batches": mqtt_adder.BATCHES.value(outcome='failed'),
+        "dropped": mqtt_adder.UPLINKS.value(outcome='dropped'),
+        "mean_batch_ms": round(batch_seconds / batches * 1000, 2) if batches else None,
+    }
+
+
+def http_load(db_path, port, clients, duration):
+    import load_test
+
+    env = dict(os.environ, DB_PATH=db_path, LOG_LEVEL='warning')
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                httpx.get(f"{url}/cache/stats", timeout=1)
+                break
+            except httpx.HTTPError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError("the API server did not start")
+                time.sleep(0.2)
+        report = {}
+        for name, bust_cache in (("cached", False), ("uncached", True)):
+            latencies, failures = asyncio.run(load_test.run(url, clients, duration, BENCH_ROUTES, bust_cache))
+            report[name] = load_test.summarize(latencies, failures, duration)
+        return report
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(report, prefix=""):
+    """Numeric leaves of a report keyed by their dotted path."""
+    values = {}
+    for key, value in report.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+
+def compare(old, new):
+    old_values, new_values = flatten(old), flatten(new)
+    print(f"{'metric':<60}{old.get('commit') or 'old':>12}{new.get('commit') or 'new':>12}{'change':>10}")
+    for path, value in new_values.items():
+        if path not in old_values:
+            continue
+        before = old_values[path]
+        change = f"{(value - before) / before * 100:+.1f}%" if before else ""
+        print(f"{path:<60}{before:>12}{value:>12}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=365, help="days of generated history")
+    parser.add_argument('--stations', type=int, default=3)
+    parser.add_argument('--interval', type=int, default=600, help="seconds between two uplinks of a station")
+    parser.add_argument('--uplinks', type=int, default=20000, help="uplinks replayed through the ingest")
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=20, help="seconds of HTTP load, cached and uncached")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--output', default='bench-report.json')
+    parser.add_argument('--compare', metavar='REPORT', help="previous report to compare with")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        # The ingest modules open the database on import
+        os.environ['DB_PATH'] = db_path
+        report = {
+            "commit": git_commit(),
+            "date": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            "config": {key: getattr(args, key) for key in ('days', 'stations', 'interval', 'uplinks', 'clients', 'duration')},
+        }
+        print(f"Generating {args.days} days x {args.stations} stations...")
+        report["generate"] = generate(db_path, args.days, args.stations, args.interval)
+        print(f"Replaying {args.uplinks} uplinks...")
+        report["ingest"] = replay(args.uplinks, args.stations)
+        import db
+        db.close()
+        print(f"HTTP load, {args.clients} clients...")
+        report["http"] = http_load(db_path, args.port, args.clients, args.duration)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps({key: report[key] for key in ("generate", "ingest")}, indent=2))
+    print(f"HTTP: {report['http']['cached'].get('all')} cached, {report['http']['uncached'].get('all')} uncached")
+    print(f"Report written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
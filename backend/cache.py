@@ -0,0 +1,107 @@
+"""In-process cache of rendered API responses.
+
+Dashboards poll the same routes every few seconds while uplinks arrive every
+few minutes. Responses are cached by path and query string for one ingest
+sequence: a counter bumped whenever another connection commits to the
+database (detected by the measurement stream) or this process writes. Each
+response carries an ETag made of the sequence, so a poll sending it back in
+If-None-Match gets a 304 without touching the database. The sequence only
+means something within one process, so ETags also carry a random id drawn
+when the cache is created: after a restart, or on another API worker, an old
+ETag never matches and the poll gets a full response. Bodies are cached
+already compressed, one entry per representation (media type and content
+coding).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import secrets
+import time
+from collections import OrderedDict
+
+from fastapi import Response
+
+from metrics import Histogram
+from serialization import MIN_COMPRESS_SIZE, compress, negotiate_encoding
+
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 256))
+
+SERIALIZE_SECONDS = Histogram('api_serialize_seconds', 'Time spent serializing and compressing a response body')
+
+
+class ResponseCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # Sequences restart at 0 in every process
+        self.boot_id = secrets.token_hex(4)
+        self.sequence = 0
+        self.entries = OrderedDict()  # key -> (sequence, body, content coding)
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def invalidate(self):
+        """Start a new sequence: every cached response is stale."""
+        self.sequence += 1
+        self.entries.clear()
+
+    def stats(self):
+        return {"boot_id": self.boot_id, "sequence": self.sequence, "entries": len(self.entries), "hits": self.hits,
+                "misses": self.misses, "not_modified": self.not_modified}
+
+    @staticmethod
+    def key(request):
+        query = sorted(request.query_params.multi_items())
+        return f"{request.url.path}?{query}"
+
+    def etag(self, sequence, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+        return f'"{self.boot_id}-{sequence}-{digest}"'
+
+    @staticmethod
+    def encode(value, render, encoding, media_type):
+        start = time.perf_counter()
+        body = render(value) if render is not None else json.dumps(value, separators=(",", ":"))
+        if isinstance(body, str):
+            body = body.encode()
+        if encoding is None or len(body) < MIN_COMPRESS_SIZE:
+            encoding = None
+        else:
+            body = compress(body, encoding)
+        SERIALIZE_SECONDS.observe(time.perf_counter() - start, media_type=media_type, encoding=encoding or 'identity')
+        return body, encoding
+
+    async def respond(self, request, compute, render=None, media_type="application/json"):
+        """Cached response to `request`, computing it with `await compute()` on a miss.
+
+        `render` turns the computed value into the body (JSON by default).
+        """
+        encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+        key = f"{self.key(request)} {media_type} {encoding}"
+        sequence = self.sequence
+        etag = self.etag(sequence, key)
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+        if etag in request.headers.get("if-none-match", ""):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == sequence:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            _, body, coding = entry
+        else:
+            self.misses += 1
+            value = await compute()
+            # Serializing and compressing a long history is CPU-bound
+            body, coding = await asyncio.to_thread(self.encode, value, render, encoding, media_type)
+            # Only keep it if no commit happened while it was computed
+            if sequence == self.sequence:
+                self.entries[key] = (sequence, body, coding)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        if coding is not None:
+            headers["Content-Encoding"] = coding
+        return Response(body, media_type=media_type, headers=headers)
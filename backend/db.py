@@ -0,0 +1,154 @@
+"""SQLite access layer shared by the API server and the MQTT ingest.
+
+The database runs in WAL mode so that readers never block the writer and the
+writer never blocks readers. Each process keeps:
+
+- a pool of read-only connections (`read_connection()`), used by the API;
+- a single writer connection (`get_writer()`), serialized by a lock, used by
+  the MQTT ingest and by the few API routes that modify data.
+
+Settings come from the environment: DB_PATH, DB_BUSY_TIMEOUT_MS and
+DB_READ_POOL_SIZE.
+"""
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = os.environ.get('DB_PATH', 'db.db')
+BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', '5000'))
+READ_POOL_SIZE = int(os.environ.get('DB_READ_POOL_SIZE', '4'))
+
+# Thousands of SQLite VM steps run by the current thread: a cheap proxy for
+# the rows a query scanned, read by the API metrics
+VM_STEP_GRANULARITY = 1000
+vm_steps = threading.local()
+
+
+def _count_vm_steps():
+    vm_steps.count = getattr(vm_steps, 'count', 0) + 1
+    return 0
+
+
+def connect(db_path=None, readonly=False):
+    """Open a connection configured for concurrent access.
+
+    Connections are in autocommit mode: transactions are opened explicitly
+    by `Writer.transaction()`, and every read runs in its own snapshot.
+    """
+    conn = sqlite3.connect(db_path or DB_PATH, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.set_progress_handler(_count_vm_steps, VM_STEP_GRANULARITY)
+    if readonly:
+        conn.execute("PRAGMA query_only = ON")
+    else:
+        # WAL is persistent in the file; NORMAL sync is durable enough in WAL
+        # mode and avoids an fsync on every commit
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+class ReadPool:
+    """Fixed-size pool of read-only connections, created on demand."""
+
+    def __init__(self, db_path=None, size=READ_POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self.idle.put(conn)
+
+    def _acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.size:
+                self.created += 1
+                return connect(self.db_path, readonly=True)
+        return self.idle.get()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self.created = 0
+
+
+class Writer:
+    """The single writer connection of a process."""
+
+    def __init__(self, db_path=None):
+        self.conn = connect(db_path)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self):
+        """Run a block in one write transaction, committed on success."""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_read_pool = None
+_writer = None
+_init_lock = threading.Lock()
+
+
+def get_read_pool():
+    global _read_pool
+    if _read_pool is None:
+        # The writer switches the file to WAL mode before any reader opens it
+        get_writer()
+        with _init_lock:
+            if _read_pool is None:
+                _read_pool = ReadPool()
+    return _read_pool
+
+
+def get_writer():
+    global _writer
+    with _init_lock:
+        if _writer is None:
+            _writer = Writer()
+        return _writer
+
+
+def read_connection():
+    """Borrow a read-only connection from the process pool."""
+    return get_read_pool().connection()
+
+
+def close():
+    """Close every connection opened by this process."""
+    global _read_pool, _writer
+    with _init_lock:
+        if _read_pool is not None:
+            _read_pool.close()
+            _read_pool = None
+        if _writer is not None:
+            _writer.close()
+            _writer = None
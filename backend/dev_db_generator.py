@@ -1,4 +1,10 @@
-import sqlite3, random
+import argparse, json, math, random, sqlite3, time
+
+import health
+import rollups
+from anomalies import backfill
+from errors import record_errors
+from migrations import LEGACY_STATION, migrate
 
 def connect_db(db_path='db.db'):
     conn = sqlite3.connect(db_path)
@@ -31,16 +37,120 @@ def add_dummy_records(c, max_device_id, n):
         c.execute("INSERT INTO Measurements (device, value) VALUES (?, ?);", (device_id, value))
 
 def add_dummy_errors(c, n):
-    for _ in range(n):
-        device_id = random.randint(1, 11)
-        error = "dummy error"
-        c.execute("INSERT INTO Errors (device, error) VALUES (?, ?);", (device_id, error))
+    recorded_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    # Errors are unique per (device, message): repeats count as occurrences
+    record_errors(c, [(random.randint(1, 11), "dummy error", recorded_at, recorded_at, 1) for _ in range(n)])
+
+# Realistic history: one uplink per station every `interval` seconds, with
+# daily and seasonal cycles, inserted with executemany in large transactions
+DAY = 86400
+YEAR = 365.25 * DAY
+HISTORY_BATCH_SIZE = 100000
+
+def new_station_state(seed):
+    """Slowly varying quantities of a station (soil moisture, pressure, battery)."""
+    rng = random.Random(seed)
+    return {'rng': rng, 'soil': rng.uniform(30, 60), 'pressure': rng.uniform(1005, 1020), 'battery': 100.0}
+
+def uplink_values(ts, state):
+    """Decoded payload of one uplink at epoch `ts`, keyed like the TTN decoder."""
+    rng = state['rng']
+    hour = (ts % DAY) / 3600 + 1  # roughly local solar time
+    day = math.sin(2 * math.pi * (hour - 9) / 24)  # peaks mid-afternoon
+    season = -math.cos(2 * math.pi * ((ts % YEAR) / DAY - 15) / 365.25)  # peaks mid-July
+    day_length = 12 + 3 * season
+    sun = max(0.0, math.sin(math.pi * (hour - 12 + day_length / 2) / day_length))
+
+    state['soil'] = min(90, max(10, state['soil'] - 0.02 + rng.gauss(0, 0.2) + (rng.uniform(5, 15) if rng.random() < 0.002 else 0)))
+    state['pressure'] = min(1050, max(960, state['pressure'] + rng.gauss(0, 0.15)))
+    state['battery'] = min(100.0, max(20.0, state['battery'] - 0.01 + 0.04 * sun))
+    return {
+        'temp2': round(min(50, max(-10, 12 + 9 * season + 6 * day + rng.gauss(0, 0.5))), 2),
+        'temp1': round(min(60, max(-10, 12 + 8 * season + 2 * math.sin(2 * math.pi * (hour - 12) / 24) + rng.gauss(0, 0.2))), 2),
+        'hum1': round(min(100, max(5, 70 - 15 * day - 5 * season + rng.gauss(0, 3))), 2),
+        'hum2': round(state['soil'], 2),
+        'hum3': round(state['soil'] * 0.95 + 3, 2),
+        'hum4': round(state['soil'] * 0.9 + 6, 2),
+        'lum': round(min(100000, 60000 * (0.6 + 0.4 * season) * sun * rng.uniform(0.3, 1) if sun > 0 else rng.uniform(0, 5)), 2),
+        'co2': round(420 + 40 * (1 - day) + rng.gauss(0, 10), 2),
+        'pression': round(state['pressure'], 2),
+        'batterie': round(state['battery'], 2),
+    }
+
+def station_devices(c, stations):
+    """Device ids by (station, sensor key), registering stations beyond the first."""
+    sensor_types = dict(c.execute("SELECT sensor_key, type FROM Device WHERE station = ?", (LEGACY_STATION,)).fetchall())
+    names = [LEGACY_STATION] + [f"station-{i}" for i in range(1, stations)]
+    for name in names[1:]:
+        c.executemany(
+            "INSERT OR IGNORE INTO Device (type, station, sensor_key) VALUES (?, ?, ?);",
+            [(device_type, name, sensor_key) for sensor_key, device_type in sensor_types.items()]
+        )
+    devices = {}
+    for name in names:
+        for row in c.execute("SELECT id, sensor_key FROM Device WHERE station = ?", (name,)):
+            devices[(name, row[1])] = row[0]
+    return names, devices
+
+def add_history(conn, days, stations=1, interval=600, end_ts=None):
+    """Insert `days` of uplinks of `stations` stations, ending at `end_ts` (now).
+
+    Rollups, anomalies and device health are then rebuilt in bulk. Returns
+    the number of measurements inserted.
+    """
+    c = conn.cursor()
+    names, devices = station_devices(c, stations)
+    conn.commit()
+    end_ts = int(end_ts or time.time())
+    start_ts = end_ts - days * DAY
+    states = {name: new_station_state(i) for i, name in enumerate(names)}
+    rows = []
+    inserted = 0
+    for ts in range(start_ts - start_ts % interval, end_ts, interval):
+        recorded_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts))
+        for name in names:
+            for sensor_key, value in uplink_values(ts, states[name]).items():
+                rows.append((devices[(name, sensor_key)], value, recorded_at, ts))
+        if len(rows) >= HISTORY_BATCH_SIZE:
+            c.executemany("INSERT INTO Measurements (device, value, recorded_at, recorded_ts) VALUES (?, ?, ?, ?);", rows)
+            conn.commit()
+            inserted += len(rows)
+            rows = []
+    c.executemany("INSERT INTO Measurements (device, value, recorded_at, recorded_ts) VALUES (?, ?, ?, ?);", rows)
+    inserted += len(rows)
+    rollups.rebuild(c)
+    backfill(c)
+    health.rebuild(c)
+    conn.commit()
+    return inserted
+
+def uplink_messages(stations, start_ts, count, interval=60):
+    """`count` TTN-style uplink messages, cycling over the station names."""
+    states = {name: new_station_state(i) for i, name in enumerate(stations)}
+    for i in range(count):
+        station = stations[i % len(stations)]
+        ts = start_ts + (i // len(stations)) * interval
+        yield station, {
+            "end_device_ids": {"device_id": station},
+            "received_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(ts)),
+            "uplink_message": {"decoded_payload": uplink_values(ts, states[station])},
+        }
+
+def write_uplinks(path, days, stations=1, interval=600):
+    """JSONL recording of `days` of uplinks ending now, for `mqtt_adder.py --source replay`."""
+    names = [LEGACY_STATION] + [f"station-{i}" for i in range(1, stations)]
+    end_ts = int(time.time())
+    count = days * DAY // interval * len(names)
+    with open(path, 'w') as f:
+        for _, message in uplink_messages(names, end_ts - days * DAY, count, interval):
+            f.write(json.dumps(message) + "\n")
+    return count
 
 def create_tables(c):
     c.execute("""
         CREATE TABLE IF NOT EXISTS Device (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type VARCHAR(255) NOT NULL CHECK(type IN ('temperature', 'humidity', 'temperaturesol','humidity10', 'humidity20', 'humidity30', 'co2', 'pressure', 'luminosity', 'battery'))
+            type VARCHAR(255) NOT NULL
         )
     """)
     
@@ -65,10 +175,27 @@ def create_tables(c):
     """)
 
 def main():
-    conn, c = connect_db()
+    parser = argparse.ArgumentParser(description="Create a development database.")
+    parser.add_argument('--db', default='db.db')
+    parser.add_argument('--days', type=int, default=0, help="days of realistic history (default: 200 random rows)")
+    parser.add_argument('--stations', type=int, default=1)
+    parser.add_argument('--interval', type=int, default=600, help="seconds between two uplinks of a station")
+    parser.add_argument('--uplinks', metavar='FILE', help="write the history as a JSONL uplink recording instead")
+    args = parser.parse_args()
+
+    if args.uplinks:
+        print(f"{write_uplinks(args.uplinks, args.days or 1, args.stations, args.interval)} uplinks written to {args.uplinks}")
+        return
+
+    conn, c = connect_db(args.db)
     create_tables(c) 
     init_capteurs(c)
-    add_dummy_records(c, 11, 200)
+    conn.commit()
+    migrate(conn)
+    if args.days:
+        add_history(conn, args.days, args.stations, args.interval)
+    else:
+        add_dummy_records(c, 11, 200)
     add_dummy_errors(c, 100)
     conn.commit()
     conn.close()
@@ -0,0 +1,90 @@
+"""Errors reported by the ingest and the anomaly detector, and their queries.
+
+An error is stored once per (device, message): repeated occurrences bump
+`occurrences` and `last_seen` instead of adding rows, so the table and the
+API payloads grow with the number of distinct problems, not with their
+frequency. Listings are paginated by keyset on the id, newest first.
+"""
+import json
+
+ERROR_COLUMNS = ('id', 'device', 'error', 'handled', 'occurrences', 'recorded_at', 'last_seen')
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# A handled error occurring again keeps its state; `last_seen` shows it is back
+RECORD_QUERY = """
+    INSERT INTO Errors (device, error, recorded_at, last_seen, occurrences)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (device, error) DO UPDATE SET
+        occurrences = occurrences + excluded.occurrences,
+        last_seen = MAX(COALESCE(last_seen, recorded_at), excluded.last_seen)
+"""
+
+
+def record_errors(c, errors):
+    """Upsert (device, error, first_seen, last_seen, occurrences) tuples.
+
+    Timestamps are UTC 'YYYY-MM-DD HH:MM:SS' strings, like recorded_at.
+    """
+    c.executemany(RECORD_QUERY, errors)
+
+
+def error_filters(device=None, handled=None, since=None, until=None):
+    """WHERE clauses and parameters shared by listings, counts and bulk updates."""
+    where, params = [], []
+    if device is not None:
+        where.append("device = ?")
+        params.append(device)
+    if handled is not None:
+        where.append("handled = ?")
+        params.append(int(handled))
+    if since is not None:
+        where.append("last_seen >= datetime(?, 'unixepoch')")
+        params.append(since)
+    if until is not None:
+        where.append("last_seen <= datetime(?, 'unixepoch')")
+        params.append(until)
+    return where, params
+
+
+def page_query(where, params, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """One page of errors with an id below `cursor`, newest first.
+
+    One extra row is fetched to tell whether another page follows.
+    """
+    where = list(where)
+    params = list(params)
+    if cursor is not None:
+        where.append("id < ?")
+        params.append(cursor)
+    sql = f"""
+        SELECT {', '.join(ERROR_COLUMNS)} FROM Errors
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY id DESC
+        LIMIT ?
+    """
+    return sql, params + [limit + 1]
+
+
+def count_query(where, params):
+    return f"SELECT COUNT(*) FROM Errors {'WHERE ' + ' AND '.join(where) if where else ''}", list(params)
+
+
+def set_handled(c, handled, ids=None, where=(), params=()):
+    """Mark the errors with the given ids, or matching `where`, in one statement.
+
+    Given both, only the listed errors that match `where` are marked.
+
+    Ids are passed as a single JSON array so that any number of them fits in
+    one statement without hitting the SQLite variable limit.
+    """
+    where = list(where)
+    params = list(params)
+    if ids is not None:
+        where.append("id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(ids))
+    return c.execute(
+        f"UPDATE Errors SET handled = ? {'WHERE ' + ' AND '.join(where) if where else ''}",
+        [int(handled)] + params,
+    ).rowcount
@@ -0,0 +1,135 @@
+"""Bulk export of raw measurements as CSV, NDJSON or Parquet.
+
+Rows are read with `fetchmany` from a dedicated read-only connection and
+encoded one batch at a time, so an export of any size is streamed in
+constant memory. Timestamps are converted per batch.
+
+Parquet needs the optional `pyarrow` package.
+"""
+import csv
+import io
+import json
+
+import db
+from queries import devices_by_type
+from timeutils import format_epochs
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_FETCH_SIZE = 5000
+
+COLUMNS = ('id', 'type', 'station', 'device', 'value', 'recorded_at', 'recorded_ts')
+
+MEDIA_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def export_batches(device_types, start_ts=None, end_ts=None):
+    """Lists of rows (tuples in COLUMNS order), ordered by device then time."""
+    conn = db.connect(readonly=True)
+    try:
+        devices = [device for ids in devices_by_type(conn, device_types).values() for device in ids]
+        if not devices:
+            return
+        where = [f"m.device IN ({', '.join('?' * len(devices))})"]
+        params = list(devices)
+        if start_ts is not None:
+            where.append("m.recorded_ts >= ?")
+            params.append(start_ts)
+        if end_ts is not None:
+            where.append("m.recorded_ts <= ?")
+            params.append(end_ts)
+        # Ordering on the (device, recorded_ts) index avoids a sort of the
+        # whole result
+        cursor = conn.execute(f"""
+            SELECT m.id, d.type, d.station, m.device, m.value, m.recorded_ts
+            FROM Measurements m
+            JOIN Device d ON m.device = d.id
+            WHERE {' AND '.join(where)}
+            ORDER BY m.device, m.recorded_ts
+        """, params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            timestamps = format_epochs([row[5] for row in rows])
+            yield [(*row[:5], recorded_at, row[5]) for row, recorded_at in zip(rows, timestamps)]
+    finally:
+        conn.close()
+
+
+def csv_chunks(batches):
+    buffer = io.StringIO()
+    out = csv.writer(buffer)
+    out.writerow(COLUMNS)
+    for batch in batches:
+        out.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(batches):
+    for batch in batches:
+        yield "".join(json.dumps(dict(zip(COLUMNS, row)), separators=(",", ":")) + "\n" for row in batch)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file collecting what the Parquet writer produced so far."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+PARQUET_SCHEMA = None if pyarrow is None else pyarrow.schema([
+    ('id', pyarrow.int64()),
+    ('type', pyarrow.string()),
+    ('station', pyarrow.string()),
+    ('device', pyarrow.int64()),
+    ('value', pyarrow.float64()),
+    ('recorded_at', pyarrow.string()),
+    ('recorded_ts', pyarrow.int64()),
+])
+
+
+def parquet_chunks(batches):
+    """Parquet file, one row group per batch, streamed as row groups are written."""
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, PARQUET_SCHEMA, compression='zstd')
+    for batch in batches:
+        columns = list(zip(*batch))
+        writer.write_batch(pyarrow.record_batch(
+            [pyarrow.array(column, type=field.type) for column, field in zip(columns, PARQUET_SCHEMA)],
+            schema=PARQUET_SCHEMA,
+        ))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {'csv': csv_chunks, 'ndjson': ndjson_chunks, 'parquet': parquet_chunks}
+
+
+def export_chunks(export_format, batches):
+    """Encoded chunks of `batches`, as produced by `export_batches`."""
+    return ENCODERS[export_format](batches)
@@ -0,0 +1,201 @@
+"""Liveness of the devices: last reading, expected interval and reporting gaps.
+
+DeviceHealth keeps, per device, the time of its first and last reading, an
+exponentially weighted estimate of the interval between readings and gap
+totals; DeviceGaps lists every silence longer than `HEALTH_GAP_FACTOR`
+expected intervals. Like the rollups they are maintained incrementally by
+`catch_up` from the rows inserted since the last run, so the status of every
+station is known without scanning Measurements.
+
+The battery trend of a station is a least-squares line fitted to the hour
+rollups of its battery device over the last `BATTERY_TREND_DAYS` days.
+
+The ingest process reports its own liveness in a small JSON heartbeat file
+(`INGEST_STATUS_PATH`), read by the API health endpoint of every worker.
+"""
+import json
+import os
+
+HIGH_WATER_KEY = 'health_high_water'
+FETCH_SIZE = 10000
+DAY = 86400
+
+# A silence longer than GAP_FACTOR expected intervals (and MIN_GAP seconds)
+# is a gap; a device silent for that long now is down
+GAP_FACTOR = float(os.environ.get('HEALTH_GAP_FACTOR', '3'))
+MIN_GAP = int(os.environ.get('HEALTH_MIN_GAP', '300'))
+# Weight of the latest interval in the expected interval
+INTERVAL_ALPHA = 0.1
+
+BATTERY_TREND_DAYS = int(os.environ.get('BATTERY_TREND_DAYS', '7'))
+BATTERY_LOW_LEVEL = float(os.environ.get('BATTERY_LOW_LEVEL', '20'))
+
+INGEST_STATUS_PATH = os.environ.get('INGEST_STATUS_PATH', 'ingest_status.json')
+# Heartbeat age after which the ingest counts as stopped
+INGEST_STALE_SECONDS = float(os.environ.get('INGEST_STALE_SECONDS', '30'))
+# Age of the oldest queued uplink above which the ingest counts as lagging
+INGEST_MAX_LAG = float(os.environ.get('INGEST_MAX_LAG', '60'))
+
+HEALTH_COLUMNS = ('device', 'first_seen_ts', 'last_seen_ts', 'expected_interval', 'readings', 'gaps',
+                  'gap_seconds', 'last_gap_start_ts', 'last_gap_end_ts')
+
+
+def gap_limit(expected_interval):
+    """Longest normal silence of a device, in seconds."""
+    return max(GAP_FACTOR * expected_interval, MIN_GAP)
+
+
+def catch_up(c):
+    """Fold measurements newer than the high-water mark into the device health.
+
+    Must run inside a write transaction. Returns the number of new gaps.
+    """
+    high_water = c.execute("SELECT value FROM Meta WHERE key = ?", (HIGH_WATER_KEY,)).fetchone()[0]
+    states = {row[0]: list(row) for row in c.execute(f"SELECT {', '.join(HEALTH_COLUMNS)} FROM DeviceHealth")}
+    cursor = c.execute("SELECT id, device, recorded_ts FROM Measurements WHERE id > ? ORDER BY id", (high_water,))
+    changed = set()
+    gaps = []
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        for measurement, device, ts in rows:
+            high_water = measurement
+            changed.add(device)
+            state = states.get(device)
+            if state is None:
+                states[device] = [device, ts, ts, None, 1, 0, 0, None, None]
+                continue
+            state[4] += 1
+            if ts < state[1]:
+                state[1] = ts
+            # Late rows of an earlier uplink do not move the clock back
+            if ts <= state[2]:
+                continue
+            interval = ts - state[2]
+            expected = state[3]
+            if expected is not None and interval > gap_limit(expected):
+                gaps.append((device, state[2], ts))
+                state[5] += 1
+                state[6] += interval
+                state[7], state[8] = state[2], ts
+            else:
+                state[3] = interval if expected is None else expected + INTERVAL_ALPHA * (interval - expected)
+            state[2] = ts
+
+    if changed:
+        c.executemany(
+            f"INSERT OR REPLACE INTO DeviceHealth ({', '.join(HEALTH_COLUMNS)}) VALUES ({', '.join('?' * len(HEALTH_COLUMNS))})",
+            [states[device] for device in changed]
+        )
+        c.executemany("INSERT INTO DeviceGaps (device, start_ts, end_ts) VALUES (?, ?, ?)", gaps)
+        c.execute("UPDATE Meta SET value = ? WHERE key = ?", (high_water, HIGH_WATER_KEY))
+    return len(gaps)
+
+
+def rebuild(c):
+    """Recompute the device health from the whole of Measurements, after a bulk load."""
+    c.execute("DELETE FROM DeviceHealth")
+    c.execute("DELETE FROM DeviceGaps")
+    c.execute("UPDATE Meta SET value = 0 WHERE key = ?", (HIGH_WATER_KEY,))
+    return catch_up(c)
+
+
+def status(row, now):
+    """'ok', 'down' (silent for longer than a gap) or 'unknown' (fewer than two readings)."""
+    if row["expected_interval"] is None:
+        return 'unknown'
+    return 'down' if now - row["last_seen_ts"] > gap_limit(row["expected_interval"]) else 'ok'
+
+
+def device_health(c, station=None):
+    """Health rows of every device (of `station`), devices never seen included."""
+    where, params = "", []
+    if station is not None:
+        where, params = "WHERE d.station = ?", [station]
+    return c.execute(f"""
+        SELECT d.id AS device, d.type, d.station, {', '.join('h.' + column for column in HEALTH_COLUMNS[1:])}
+        FROM Device d
+        LEFT JOIN DeviceHealth h ON h.device = d.id
+        {where}
+        ORDER BY d.station, d.id
+    """, params).fetchall()
+
+
+def battery_trends(c, now, station=None):
+    """{device: (level, slope per day)} of the battery devices.
+
+    The slope is fitted by least squares to the hourly averages of the last
+    BATTERY_TREND_DAYS days, in SQL from the running sums; it is None with
+    fewer than two hours of data.
+    """
+    since = now - BATTERY_TREND_DAYS * DAY
+    where, params = "", [since, since]
+    if station is not None:
+        where, params = "AND d.station = ?", [since, since, station]
+    rows = c.execute(f"""
+        SELECT d.id AS device, l.value AS level, f.n, f.sx, f.sy, f.sxx, f.sxy
+        FROM Device d
+        LEFT JOIN LatestValues l ON l.device = d.id
+        LEFT JOIN (
+            SELECT device, COUNT(*) AS n, SUM(x) AS sx, SUM(y) AS sy, SUM(x * x) AS sxx, SUM(x * y) AS sxy
+            FROM (
+                SELECT device, (bucket_ts - ?) / 86400.0 AS x, sum / count AS y
+                FROM Rollups
+                WHERE resolution = 3600 AND bucket_ts >= ?
+                  AND device IN (SELECT id FROM Device WHERE type = 'battery')
+            )
+            GROUP BY device
+        ) f ON f.device = d.id
+        WHERE d.type = 'battery' {where}
+    """, params).fetchall()
+    trends = {}
+    for row in rows:
+        slope = None
+        if row["n"] and row["n"] >= 2:
+            denominator = row["n"] * row["sxx"] - row["sx"] ** 2
+            if denominator > 0:
+                slope = (row["n"] * row["sxy"] - row["sx"] * row["sy"]) / denominator
+        trends[row["device"]] = (row["level"], slope)
+    return trends
+
+
+def days_to_low(level, slope):
+    """Days until the battery reaches BATTERY_LOW_LEVEL at the current trend (None: not draining)."""
+    if level is None or slope is None or slope >= 0:
+        return None
+    return max(0.0, (level - BATTERY_LOW_LEVEL) / -slope)
+
+
+def device_gaps(c, device, start_ts=None, end_ts=None, limit=100):
+    """Gaps of a device overlapping [start_ts, end_ts], newest first."""
+    where, params = ["device = ?"], [device]
+    if start_ts is not None:
+        where.append("end_ts >= ?")
+        params.append(start_ts)
+    if end_ts is not None:
+        where.append("start_ts <= ?")
+        params.append(end_ts)
+    return c.execute(f"""
+        SELECT start_ts, end_ts FROM DeviceGaps
+        WHERE {' AND '.join(where)}
+        ORDER BY start_ts DESC
+        LIMIT ?
+    """, params + [limit]).fetchall()
+
+
+def write_ingest_status(status, path=INGEST_STATUS_PATH):
+    """Replace the heartbeat file atomically, readers never see half of it."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(tmp_path, path)
+
+
+def read_ingest_status(path=INGEST_STATUS_PATH):
+    """Last heartbeat of the ingest, or None if it never ran."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
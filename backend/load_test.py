@@ -0,0 +1,109 @@
+"""Simulate concurrent dashboard clients against a running API server.
+
+Each client loops over the routes polled by the dashboard pages for the given
+duration; latencies are then reported per route as p50/p99. Run it against
+two revisions of the server to compare them:
+
+    uvicorn server:app --port 8000
+    python load_test.py --url http://localhost:8000 --clients 20 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+DASHBOARD_ROUTES = [
+    "/temperatures-humidity",
+    "/soil-humidity",
+    "/luminosity",
+    "/co2",
+    "/pressure",
+    "/battery",
+    "/temperaturesol",
+    "/errors",
+    "/check-abnormal-measurements",
+]
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def dashboard_client(client, routes, deadline, latencies, failures, bust_cache=False):
+    while time.perf_counter() < deadline:
+        for route in routes:
+            url = route
+            if bust_cache:
+                # A unique parameter makes every request miss the response cache
+                url += f"{'&' if '?' in route else '?'}nocache={time.perf_counter_ns()}"
+            start = time.perf_counter()
+            try:
+                response = await client.get(url)
+                response.raise_for_status()
+            except httpx.HTTPError:
+                failures[route] = failures.get(route, 0) + 1
+                continue
+            latencies.setdefault(route, []).append((time.perf_counter() - start) * 1000)
+
+
+async def run(url, clients, duration, routes, bust_cache=False):
+    latencies = {}
+    failures = {}
+    limits = httpx.Limits(max_connections=clients)
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(dashboard_client(client, routes, deadline, latencies, failures, bust_cache) for _ in range(clients)))
+    return latencies, failures
+
+
+def summarize(latencies, failures, duration):
+    """Per-route request count, p50 and p99 in milliseconds."""
+    report = {}
+    every = []
+    for route, samples in latencies.items():
+        every.extend(samples)
+        report[route] = {
+            "requests": len(samples),
+            "errors": failures.get(route, 0),
+            "p50_ms": round(percentile(samples, 50), 2),
+            "p99_ms": round(percentile(samples, 99), 2),
+        }
+    if every:
+        report["all"] = {
+            "requests": len(every),
+            "errors": sum(failures.values()),
+            "p50_ms": round(percentile(every, 50), 2),
+            "p99_ms": round(percentile(every, 99), 2),
+            "requests_per_s": round(len(every) / duration, 1),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=30, help="seconds")
+    parser.add_argument('--routes', nargs='+', default=DASHBOARD_ROUTES)
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    parser.add_argument('--bust-cache', action='store_true', help="make every request miss the response cache")
+    args = parser.parse_args()
+
+    latencies, failures = asyncio.run(run(args.url, args.clients, args.duration, args.routes, args.bust_cache))
+    report = summarize(latencies, failures, args.duration)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{'route':<32}{'requests':>10}{'errors':>8}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+    for route, stats in report.items():
+        print(f"{route:<32}{stats['requests']:>10}{stats['errors']:>8}{stats['p50_ms']:>10}{stats['p99_ms']:>10}")
+    if "all" in report:
+        print(f"\n{report['all']['requests_per_s']} requests/s with {args.clients} clients")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""Prometheus-style metrics and structured logs, for the API and the MQTT ingest.
+
+Metrics are kept in process memory and rendered in the Prometheus text
+format by `render()`: the API serves them at `/metrics`, the ingest process
+with `serve()` on its own port. Recording a sample is a dict update under a
+lock, cheap enough for every request, query and batch. `log_event` writes one
+JSON object per line, easy to grep or to ship to a log collector.
+
+An API served by several worker processes keeps one registry per worker.
+With `METRICS_DIR`, each worker publishes a snapshot of its metrics there
+(`SharedMetrics`), and `/metrics` on any worker renders the snapshots of all
+of them, each sample labelled with the `worker` pid it comes from.
+"""
+import glob
+import json
+import math
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOG_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get('LOG_LEVEL', 'info').lower(), 20)
+
+# Seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Rows, points, uplinks...
+COUNT_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+METRICS_DIR = os.environ.get('METRICS_DIR')
+# Seconds between snapshots of a worker, and age after which the snapshot of
+# a worker that stopped publishing is left out
+PUBLISH_INTERVAL = 5.0
+STALE_SECONDS = 30.0
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, function=None):
+        """`function`, if given, returns the current value when metrics are rendered."""
+        self.name = name
+        self.help = help
+        self.function = function
+        self.values = {}
+        with _lock:
+            _registry.append(self)
+
+    def samples(self):
+        if self.function is not None:
+            yield self.name, (), self.function()
+            return
+        with _lock:
+            values = list(self.values.items())
+        for key, value in values:
+            yield self.name, key, value
+
+    def value(self, **labels):
+        with _lock:
+            return self.values.get(_label_key(labels), 0)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with _lock:
+            self.values[_label_key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += 1
+            state[2] += value
+
+    def samples(self):
+        with _lock:
+            values = [(key, list(counts), count, total) for key, (counts, count, total) in self.values.items()]
+        for key, counts, count, total in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket', key + (('le', _format_value(bound)),), cumulative
+            yield f'{self.name}_count', key, count
+            yield f'{self.name}_sum', key, total
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+
+
+def snapshot():
+    """[(name, help, kind, [(sample name, label key, value)])] of every metric of the process."""
+    return [(metric.name, metric.help, metric.kind, list(metric.samples())) for metric in list(_registry)]
+
+
+def render(snapshots=None):
+    """Metrics in the Prometheus text format.
+
+    `snapshots` is a list of (extra labels, `snapshot()`), merged family by
+    family; by default the metrics of this process alone.
+    """
+    if snapshots is None:
+        snapshots = [((), snapshot())]
+    families = {}
+    for extra, metrics in snapshots:
+        for name, help, kind, samples in metrics:
+            family = families.setdefault(name, (help, kind, []))
+            family[2].extend((sample, key, extra, value) for sample, key, value in samples)
+    lines = []
+    for name, (help, kind, samples) in families.items():
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {kind}')
+        for sample, key, extra, value in samples:
+            lines.append(f'{sample}{_format_labels(key, extra)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+class SharedMetrics:
+    """Metrics of every worker of a multi-process server, shared through a directory.
+
+    Each worker writes its snapshot to `<directory>/<pid>.json` every
+    PUBLISH_INTERVAL seconds and when rendering, so that a scrape reaching
+    any worker sees all of them.
+    """
+
+    def __init__(self, directory=METRICS_DIR):
+        self.directory = directory
+        self.path = os.path.join(directory, f'{os.getpid()}.json')
+        self.stopping = threading.Event()
+
+    def publish(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot(), f)
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        while not self.stopping.wait(PUBLISH_INTERVAL):
+            self.publish()
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.publish()
+        threading.Thread(target=self._run, name='metrics-publish', daemon=True).start()
+
+    def stop(self):
+        self.stopping.set()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def render(self):
+        self.publish()
+        snapshots = []
+        for path in sorted(glob.glob(os.path.join(self.directory, '*.json'))):
+            try:
+                if time.time() - os.path.getmtime(path) > STALE_SECONDS:
+                    continue
+                with open(path) as f:
+                    metrics = json.load(f)
+            except (OSError, ValueError):
+                continue
+            worker = os.path.basename(path)[:-len('.json')]
+            snapshots.append(((('worker', worker),), [
+                (name, help, kind, [(sample, tuple(map(tuple, key)), value) for sample, key, value in samples])
+                for name, help, kind, samples in metrics
+            ]))
+        return render(snapshots)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='0.0.0.0'):
+    """Serve /metrics from a background thread (for processes without an API)."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+def log_event(event, level='info', **fields):
+    """Write one structured log line, if `level` is enabled by LOG_LEVEL."""
+    if LOG_LEVELS[level] < LOG_LEVEL:
+        return
+    record = {'ts': round(time.time(), 3), 'level': level, 'event': event, **fields}
+    sys.stdout.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+    sys.stdout.flush()
@@ -0,0 +1,355 @@
+"""Versioned schema migrations for the SQLite database.
+
+The current schema version is stored in `PRAGMA user_version`. Each migration
+runs in its own transaction and bumps the version, so an existing `db.db` can
+be upgraded in place at any time:
+
+    python migrations.py [db_path]
+"""
+import sqlite3
+import sys
+
+
+def migration_1(c):
+    """Integer id/epoch columns on Measurements and composite indexes."""
+    # Measurements had no primary key: rebuild it with a stable id (keeping
+    # the old rowids) and an integer epoch copy of recorded_at
+    c.execute("""
+        CREATE TABLE Measurements_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device INTEGER,
+            value DECIMAL(10, 2),
+            recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            recorded_ts INTEGER,
+            FOREIGN KEY (device) REFERENCES Device(id) ON DELETE CASCADE
+        )
+    """)
+    c.execute("""
+        INSERT INTO Measurements_new (id, device, value, recorded_at, recorded_ts)
+        SELECT rowid, device, value, recorded_at, CAST(strftime('%s', recorded_at) AS INTEGER)
+        FROM Measurements
+        ORDER BY rowid
+    """)
+    c.execute("DROP TABLE Measurements")
+    c.execute("ALTER TABLE Measurements_new RENAME TO Measurements")
+
+    # Writers that only give (device, value) still get recorded_ts filled in
+    c.execute("""
+        CREATE TRIGGER measurements_recorded_ts AFTER INSERT ON Measurements
+        WHEN NEW.recorded_ts IS NULL
+        BEGIN
+            UPDATE Measurements
+            SET recorded_ts = CAST(strftime('%s', NEW.recorded_at) AS INTEGER)
+            WHERE id = NEW.id;
+        END
+    """)
+
+    c.execute("CREATE INDEX idx_measurements_device_ts ON Measurements (device, recorded_ts)")
+    c.execute("CREATE INDEX idx_errors_device_error ON Errors (device, error, recorded_at)")
+
+
+# Sensor keys of the original field station, which owns Device rows 1-11
+LEGACY_STATION = 'captor-controller'
+LEGACY_SENSOR_KEYS = {
+    1: 'temp2', 2: 'hum1', 3: 'temp1', 4: 'hum2', 5: 'hum3', 6: 'hum4',
+    7: 'lum', 8: 'co2', 10: 'pression', 11: 'batterie',
+}
+
+
+def migration_2(c):
+    """Station and sensor key on Device for multi-station ingestion."""
+    c.execute("ALTER TABLE Device ADD COLUMN station VARCHAR(255)")
+    c.execute("ALTER TABLE Device ADD COLUMN sensor_key VARCHAR(255)")
+    c.executemany(
+        "UPDATE Device SET station = ?, sensor_key = ? WHERE id = ?",
+        [(LEGACY_STATION, sensor_key, device) for device, sensor_key in LEGACY_SENSOR_KEYS.items()],
+    )
+    c.execute("CREATE UNIQUE INDEX idx_device_station_sensor ON Device (station, sensor_key)")
+
+
+def migration_3(c):
+    """Incremental anomaly detection state and results."""
+    # Small key/value table for process-wide counters and high-water marks
+    c.execute("""
+        CREATE TABLE Meta (
+            key VARCHAR(255) PRIMARY KEY,
+            value INTEGER
+        )
+    """)
+    c.execute("""
+        CREATE TABLE AnomalyState (
+            device INTEGER PRIMARY KEY,
+            value DECIMAL(10, 2),
+            measurement INTEGER,
+            FOREIGN KEY (device) REFERENCES Device(id) ON DELETE CASCADE
+        )
+    """)
+    c.execute("""
+        CREATE TABLE Anomalies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device INTEGER,
+            measurement INTEGER,
+            previous_value DECIMAL(10, 2),
+            current_value DECIMAL(10, 2),
+            difference REAL,
+            threshold REAL,
+            recorded_ts INTEGER,
+            FOREIGN KEY (device) REFERENCES Device(id) ON DELETE CASCADE
+        )
+    """)
+    c.execute("CREATE INDEX idx_anomalies_recorded_ts ON Anomalies (recorded_ts)")
+
+    # Existing rows were already checked by the old full-window scan: resume
+    # after them, from the latest value of each device
+    c.execute("""
+        INSERT INTO AnomalyState (device, value, measurement)
+        SELECT device, value, MAX(id) FROM Measurements GROUP BY device
+    """)
+    c.execute("""
+        INSERT INTO Meta (key, value)
+        VALUES ('anomaly_high_water', COALESCE((SELECT MAX(id) FROM Measurements), 0))
+    """)
+
+
+def migration_4(c):
+    """Minute, hour and day rollups of Measurements."""
+    c.execute("""
+        CREATE TABLE Rollups (
+            resolution INTEGER,
+            device INTEGER,
+            bucket_ts INTEGER,
+            count INTEGER,
+            sum REAL,
+            min REAL,
+            max REAL,
+            last REAL,
+            last_ts INTEGER,
+            PRIMARY KEY (resolution, device, bucket_ts)
+        ) WITHOUT ROWID
+    """)
+    for resolution in (60, 3600, 86400):
+        c.execute("""
+            INSERT INTO Rollups (resolution, device, bucket_ts, count, sum, min, max, last_ts)
+            SELECT ?, device, (recorded_ts / ?) * ?, COUNT(*), SUM(value), MIN(value), MAX(value), MAX(recorded_ts)
+            FROM Measurements
+            WHERE value IS NOT NULL
+            GROUP BY device, (recorded_ts / ?) * ?
+        """, (resolution,) + (resolution,) * 4)
+    c.execute("""
+        UPDATE Rollups SET last = (
+            SELECT m.value FROM Measurements m
+            WHERE m.device = Rollups.device AND m.recorded_ts = Rollups.last_ts
+            ORDER BY m.id DESC LIMIT 1
+        )
+    """)
+    c.execute("""
+        INSERT INTO Meta (key, value)
+        VALUES ('rollup_high_water', COALESCE((SELECT MAX(id) FROM Measurements), 0))
+    """)
+
+
+def migration_5(c):
+    """Occurrence counts on Errors, one row per (device, error)."""
+    c.execute("ALTER TABLE Errors ADD COLUMN occurrences INTEGER DEFAULT 1")
+    c.execute("ALTER TABLE Errors ADD COLUMN last_seen TIMESTAMP")
+    # Fold duplicates into their oldest row; the group stays unhandled
+    # unless every copy was handled
+    c.execute("""
+        CREATE TEMP TABLE error_groups AS
+        SELECT MIN(id) AS id, COUNT(*) AS occurrences, MAX(recorded_at) AS last_seen, MIN(handled) AS handled
+        FROM Errors
+        GROUP BY device, error
+    """)
+    c.execute("""
+        UPDATE Errors SET
+            occurrences = g.occurrences,
+            last_seen = COALESCE(g.last_seen, Errors.recorded_at),
+            handled = g.handled
+        FROM error_groups g
+        WHERE g.id = Errors.id
+    """)
+    c.execute("DELETE FROM Errors WHERE id NOT IN (SELECT id FROM error_groups)")
+    c.execute("DROP TABLE error_groups")
+    c.execute("DROP INDEX idx_errors_device_error")
+    c.execute("CREATE UNIQUE INDEX idx_errors_device_error ON Errors (device, error)")
+    # Keyset pagination of the unhandled/handled lists
+    c.execute("CREATE INDEX idx_errors_handled_id ON Errors (handled, id)")
+
+
+def migration_6(c):
+    """Latest value per device and error counters for overviews."""
+    c.execute("""
+        CREATE TABLE LatestValues (
+            device INTEGER PRIMARY KEY,
+            value DECIMAL(10, 2),
+            recorded_ts INTEGER,
+            FOREIGN KEY (device) REFERENCES Device(id) ON DELETE CASCADE
+        )
+    """)
+    # The day rollups are up to date with the rollup high-water mark, which
+    # catch_up resumes from
+    c.execute("""
+        INSERT INTO LatestValues (device, value, recorded_ts)
+        SELECT device, last, MAX(last_ts) FROM Rollups WHERE resolution = 86400 GROUP BY device
+    """)
+
+    # Kept exact by triggers, whoever writes to Errors
+    c.execute("""
+        CREATE TABLE ErrorCounts (
+            device INTEGER PRIMARY KEY,
+            errors INTEGER,
+            unhandled INTEGER,
+            occurrences INTEGER
+        )
+    """)
+    c.execute("""
+        INSERT INTO ErrorCounts (device, errors, unhandled, occurrences)
+        SELECT device, COUNT(*), SUM(NOT handled), SUM(occurrences) FROM Errors GROUP BY device
+    """)
+    c.execute("""
+        CREATE TRIGGER error_counts_insert AFTER INSERT ON Errors
+        BEGIN
+            INSERT INTO ErrorCounts (device, errors, unhandled, occurrences)
+            VALUES (NEW.device, 1, NOT NEW.handled, NEW.occurrences)
+            ON CONFLICT (device) DO UPDATE SET
+                errors = errors + 1,
+                unhandled = unhandled + excluded.unhandled,
+                occurrences = occurrences + excluded.occurrences;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER error_counts_update AFTER UPDATE OF handled, occurrences ON Errors
+        BEGIN
+            UPDATE ErrorCounts SET
+                unhandled = unhandled + (NOT NEW.handled) - (NOT OLD.handled),
+                occurrences = occurrences + NEW.occurrences - OLD.occurrences
+            WHERE device = NEW.device;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER error_counts_delete AFTER DELETE ON Errors
+        BEGIN
+            UPDATE ErrorCounts SET
+                errors = errors - 1,
+                unhandled = unhandled - (NOT OLD.handled),
+                occurrences = occurrences - OLD.occurrences
+            WHERE device = OLD.device;
+        END
+    """)
+
+
+def migration_7(c):
+    """Device types from the sensor registry instead of a CHECK constraint."""
+    # SQLite cannot drop a constraint: rebuild the table, keeping the ids
+    # referenced by the other tables
+    c.execute("""
+        CREATE TABLE Device_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type VARCHAR(255) NOT NULL,
+            station VARCHAR(255),
+            sensor_key VARCHAR(255)
+        )
+    """)
+    c.execute("INSERT INTO Device_new (id, type, station, sensor_key) SELECT id, type, station, sensor_key FROM Device")
+    c.execute("DROP TABLE Device")
+    c.execute("ALTER TABLE Device_new RENAME TO Device")
+    c.execute("CREATE UNIQUE INDEX idx_device_station_sensor ON Device (station, sensor_key)")
+
+
+def migration_8(c):
+    """Learned model of normal changes for anomaly detection."""
+    # Mean and variance of the changes of a device during one UTC hour of the
+    # day; empty slots fall back to the registry thresholds until learned
+    c.execute("""
+        CREATE TABLE AnomalyModel (
+            device INTEGER,
+            slot INTEGER,
+            count INTEGER,
+            mean REAL,
+            variance REAL,
+            PRIMARY KEY (device, slot)
+        ) WITHOUT ROWID
+    """)
+
+
+def migration_9(c):
+    """Device liveness and reporting gaps."""
+    c.execute("""
+        CREATE TABLE DeviceHealth (
+            device INTEGER PRIMARY KEY,
+            first_seen_ts INTEGER,
+            last_seen_ts INTEGER,
+            expected_interval REAL,
+            readings INTEGER,
+            gaps INTEGER,
+            gap_seconds INTEGER,
+            last_gap_start_ts INTEGER,
+            last_gap_end_ts INTEGER,
+            FOREIGN KEY (device) REFERENCES Device(id) ON DELETE CASCADE
+        )
+    """)
+    c.execute("""
+        CREATE TABLE DeviceGaps (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device INTEGER,
+            start_ts INTEGER,
+            end_ts INTEGER,
+            FOREIGN KEY (device) REFERENCES Device(id) ON DELETE CASCADE
+        )
+    """)
+    c.execute("CREATE INDEX idx_device_gaps_device_start ON DeviceGaps (device, start_ts)")
+    # Built from the retained history by the next catch-up
+    c.execute("INSERT INTO Meta (key, value) VALUES ('health_high_water', 0)")
+
+
+# Ordered list of (version, migration); append new migrations at the end
+MIGRATIONS = [
+    (1, migration_1),
+    (2, migration_2),
+    (3, migration_3),
+    (4, migration_4),
+    (5, migration_5),
+    (6, migration_6),
+    (7, migration_7),
+    (8, migration_8),
+    (9, migration_9),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Apply every pending migration to the connection's database."""
+    version = get_version(conn)
+    for target, migration in MIGRATIONS:
+        if target <= version:
+            continue
+        c = conn.cursor()
+        c.execute("BEGIN")
+        try:
+            migration(c)
+            c.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Migrated database to version {target} ({migration.__doc__})")
+        version = target
+    return version
+
+
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'db.db'
+    conn = sqlite3.connect(db_path)
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
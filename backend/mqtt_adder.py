@@ -1,7 +1,33 @@
-import paho.mqtt.client as mqtt
+"""Ingest engine: decodes TTN uplinks and writes them to SQLite in batches.
+
+Uplinks come from a pluggable source (see `sources.py`): live TTN by default,
+a local MQTT broker, or a JSONL recording replayed at any speed:
+
+    python mqtt_adder.py
+    python mqtt_adder.py --source broker --host localhost --port 1883
+    python mqtt_adder.py --source replay --file uplinks.jsonl --speed 0
+
+SIGTERM stops it like Ctrl+C: the sources are closed, then every queued
+uplink is written before exiting. Nothing runs at import: the engine can be
+started and stopped again from another program with `run` (or
+`start_ingest`/`stop_ingest`).
+"""
+import argparse
 import json
+import os
+import queue
+import signal
+import threading
 import time
-import sqlite3
+
+import db
+import health
+import metrics
+import rollups
+from anomalies import AnomalyDetector
+from errors import record_errors
+from sensors import SENSOR_TYPES, SENSORS, VALIDATORS
+from sources import UPLINK_TOPIC, MQTTSource, ReplaySource, ttn_source
 
 # ===================================
 # Récupération des données depuis TTN 
@@ -14,67 +40,102 @@ access_key = "NNSXS.CBQW4DRZ36OCTHXFA4436UNZSO2RPIW4LPZ6L4A.JOGRGLXEMR3XXV53WZIW
 broker = "eu1.cloud.thethings.network"
 port = 8883  # Port sécurisé MQTT
 
-# -------------------------
-# Connexion à la base SQLite
-# -------------------------
-def connect_db(db_path='db.db'):
-    conn = sqlite3.connect(db_path, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn, conn.cursor()
-
-conn, cursor = connect_db()
-
-# Mapping des capteurs selon le schéma de la base de données
-DEVICE_MAPPING = {
-    'temp2': 1,        # temperature
-    'hum1': 2,         # humidity
-    'temp1': 3,        # temperaturesol
-    'hum2': 4,         # humidity10
-    'hum3': 5,         # humidity20
-    'hum4': 6,         # humidity30
-    'lum': 7,          # luminosity
-    'co2': 8,          # co2
-    'pression': 10,    # pressure
-    'batterie': 11     # battery
-}
-
-# Define acceptable ranges for each sensor type
-SENSOR_VALIDATION = {
-    'temp1': {'min': -10, 'max': 60, 'description': 'Soil temperature'},  # Soil temperature in °C
-    'temp2': {'min': -10, 'max': 50, 'description': 'Air temperature'},   # Air temperature in °C
-    'hum1': {'min': 0, 'max': 100, 'description': 'Air humidity'},        # Air humidity %
-    'hum2': {'min': 0, 'max': 100, 'description': 'Soil humidity 10cm'},  # Soil humidity at 10cm %
-    'hum3': {'min': 0, 'max': 100, 'description': 'Soil humidity 20cm'},  # Soil humidity at 20cm %
-    'hum4': {'min': 0, 'max': 100, 'description': 'Soil humidity 30cm'},  # Soil humidity at 30cm %
-    'lum': {'min': 0, 'max': 100000, 'description': 'Luminosity'},        # Luminosity in lux
-    'co2': {'min': 0, 'max': 5000, 'description': 'CO2 level'},           # CO2 in ppm
-    'pression': {'min': 900, 'max': 1100, 'description': 'Atmospheric pressure'}, # Pressure in hPa
-    'batterie': {'min': 0, 'max': 100, 'description': 'Battery level'}    # Battery percentage
-}
-
-def validate_sensor_value(sensor_name, value):
+# Applications TTN suivies, "app_id:access_key" séparés par des virgules.
+# Every end device of each application is followed (wildcard topic).
+APPLICATIONS = [
+    tuple(entry.split(':', 1))
+    for entry in os.environ.get('TTN_APPLICATIONS', f"{app_id}:{access_key}").split(',')
+    if entry
+]
+
+# Identifiant de session MQTT persistante (optionnel). With it, the broker
+# keeps the subscriptions and queues QoS 1 uplinks while the ingest restarts.
+MQTT_CLIENT_ID = os.environ.get('MQTT_CLIENT_ID') or None
+
+# Détection des variations anormales, au fil de l'ingestion
+detector = AnomalyDetector()
+
+# In-memory cache of Device ids keyed by (end device id, sensor key). Only the
+# writer thread reads and fills it, so resolving a sensor costs no DB query
+# once its station has been seen.
+device_cache = {}
+
+def load_device_cache():
+    with db.read_connection() as c:
+        rows = c.execute("SELECT id, station, sensor_key FROM Device WHERE station IS NOT NULL").fetchall()
+    device_cache.clear()
+    device_cache.update({(row["station"], row["sensor_key"]): row["id"] for row in rows})
+
+def resolve_device(c, station, sensor_name, registered):
+    """Id du Device d'un capteur d'une station, créé au premier uplink.
+
+    New ids are collected in `registered` and only added to the cache by the
+    caller once the transaction has committed.
     """
-    Validates if a sensor value is within the acceptable range.
-    Returns (is_valid, error_message)
+    key = (station, sensor_name)
+    device = device_cache.get(key) or registered.get(key)
+    if device is None:
+        c.execute(
+            "INSERT OR IGNORE INTO Device (type, station, sensor_key) VALUES (?, ?, ?);",
+            (SENSOR_TYPES[sensor_name], station, sensor_name)
+        )
+        device = c.execute(
+            "SELECT id FROM Device WHERE station = ? AND sensor_key = ?;", key
+        ).fetchone()[0]
+        registered[key] = device
+        metrics.log_event('device_registered', station=station, sensor=sensor_name, device=device)
+    return device
+
+# Champs du payload décodé (exactement les mêmes noms que dans decodeUplink)
+PAYLOAD_FIELDS = list(SENSORS)
+
+def insert_uplinks_in_db(uplinks):
+    """Insère un lot d'uplinks en une seule transaction.
+
+    `uplinks` is a list of (received_ts, station, values) tuples, where
+    `values` maps payload fields to their decoded value. Valid values are
+    written to Measurements with one executemany; invalid ones become Errors,
+    one row per (device, message) counting its occurrences.
     """
-    if value is None:
-        return False, "Value is missing"
-    
-    if sensor_name not in SENSOR_VALIDATION:
-        return False, f"Unknown sensor type: {sensor_name}"
-    
-    validation = SENSOR_VALIDATION[sensor_name]
-    if not isinstance(value, (int, float)):
-        return False, f"Value must be numeric, got {type(value)}"
-    
-    if value < validation['min'] or value > validation['max']:
-        return False, f"Value {value} out of range ({validation['min']}-{validation['max']}) for {validation['description']}"
-    
-    return True, None
-
-def insert_uplink_in_db(batterie, pression, co2, lum, hum4, hum3, hum2, hum1, temp2, temp1):
-    """Insère les champs du payload dans la table Measurements selon le mapping des capteurs."""
-    # Création d'un dictionnaire pour faciliter le traitement
+    measurements = []
+    errors = {}
+    registered = {}
+    # Single dedicated writer connection (WAL mode, shared with the API readers)
+    with db.get_writer().transaction() as c:
+        for received_ts, station, values in uplinks:
+            recorded_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(received_ts))
+            for sensor_name, value in values.items():
+                validator = VALIDATORS.get(sensor_name)
+                if value is not None and validator is not None:
+                    device_id = resolve_device(c, station, sensor_name, registered)
+
+                    # Validate the sensor value
+                    error_message = validator(value)
+
+                    if error_message is None:
+                        measurements.append((device_id, value, recorded_at, int(received_ts)))
+                    else:
+                        REJECTS.inc(sensor=sensor_name)
+                        seen = errors.setdefault((device_id, error_message), [recorded_at, recorded_at, 0])
+                        seen[1] = max(seen[1], recorded_at)
+                        seen[2] += 1
+
+        c.executemany(
+            "INSERT INTO Measurements (device, value, recorded_at, recorded_ts) VALUES (?, ?, ?, ?);",
+            measurements
+        )
+        # Compare the new rows with the previous value of their device and
+        # fold them into the rollups and the device health
+        detector.catch_up(c)
+        rollups.catch_up(c)
+        health.catch_up(c)
+        # Repeated errors only bump the occurrence count of their row
+        record_errors(c, [(device_id, error_message, *seen) for (device_id, error_message), seen in errors.items()])
+    device_cache.update(registered)
+    return len(measurements), len(errors)
+
+def insert_uplink_in_db(batterie, pression, co2, lum, hum4, hum3, hum2, hum1, temp2, temp1, station=device_id):
+    """Insère les champs d'un payload dans la table Measurements selon le mapping des capteurs."""
     values = {
         'batterie': batterie,
         'pression': pression,
@@ -87,119 +148,324 @@ def insert_uplink_in_db(batterie, pression, co2, lum, hum4, hum3, hum2, hum1, te
         'temp2': temp2,
         'temp1': temp1
     }
-    
-    # Insertion de chaque valeur dans la table Measurements après validation
-    for sensor_name, value in values.items():
-        if value is not None and sensor_name in DEVICE_MAPPING:
-            device_id = DEVICE_MAPPING[sensor_name]
-            
-            # Validate the sensor value
-            is_valid, error_message = validate_sensor_value(sensor_name, value)
-            
-            if is_valid:
-                # Insert valid value into measurements
-                cursor.execute(
-                    "INSERT INTO Measurements (device, value) VALUES (?, ?);",
-                    (device_id, value)
-                )
-            else:
-                # Check if an error for this device already exists
-                cursor.execute(
-                    "SELECT COUNT(*) FROM Errors WHERE device = ? AND error = ?;",
-                    (device_id, error_message)
-                )
-                error_exists = cursor.fetchone()[0] > 0
-
-                if not error_exists:
-                    # Insert error for invalid value if it doesn't already exist
-                    cursor.execute(
-                        "INSERT INTO Errors (device, error) VALUES (?, ?);", 
-                        (device_id, error_message)
-                    )
-    
-    conn.commit()
+    insert_uplinks_in_db([(time.time(), station, values)])
 
-# ---------------
-# Callbacks MQTT
-# ---------------
-def on_connect(client, userdata, flags, reason_code, properties=None):
-    """Callback déclenché lors de la connexion au broker."""
-    if reason_code == 0:
-        print("✅ Connecté à TTN MQTT Broker")
-        topic = f"v3/{app_id}@ttn/devices/{device_id}/up"
-        client.subscribe(topic)
-        print(f"📡 Abonné au topic : {topic}")
-    else:
-        print(f"❌ Échec de connexion, code erreur : {reason_code}")
-
-def on_message(client, userdata, message):
-    """Callback déclenché lors de la réception d'un message MQTT."""
+# ------------------------------------------
+# File d'attente entre MQTT et la base SQLite
+# ------------------------------------------
+# The paho network thread only decodes and enqueues uplinks; a writer thread
+# flushes them to SQLite in batches, on size or on time
+QUEUE_MAXSIZE = int(os.environ.get('INGEST_QUEUE_SIZE', '10000'))
+BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', '500'))
+FLUSH_INTERVAL = float(os.environ.get('INGEST_FLUSH_INTERVAL', '1.0'))  # seconds
+ENQUEUE_TIMEOUT = 0.5  # seconds the MQTT thread may block on a full queue
+STATS_INTERVAL = 60    # seconds between two ingestion reports
+
+# A failed batch (e.g. SQLITE_BUSY while another process holds the write
+# lock) is retried with a doubling delay, then spilled to a JSONL file of
+# SPILL_DIR that the writer thread writes again later: no batch is discarded
+BATCH_RETRIES = int(os.environ.get('INGEST_BATCH_RETRIES', '5'))
+RETRY_DELAY = 0.2      # seconds before the first retry
+MAX_RETRY_DELAY = 5.0
+SPILL_DIR = os.environ.get('INGEST_SPILL_DIR', 'spill')
+
+uplink_queue = queue.Queue(maxsize=QUEUE_MAXSIZE)
+STOP = object()
+
+# Backpressure and throughput metrics, served on METRICS_PORT and reported
+# every STATS_INTERVAL
+METRICS_PORT = int(os.environ.get('INGEST_METRICS_PORT', '9101'))
+MESSAGES = metrics.Counter('ingest_messages_total', 'MQTT messages received')
+UPLINKS = metrics.Counter('ingest_uplinks_total', 'Uplinks by outcome in the queue (queued, blocked, dropped)')
+BATCHES = metrics.Counter('ingest_batches_total', 'Batches by outcome (ok, failed, spilled, unspilled)')
+MEASUREMENTS = metrics.Counter('ingest_measurements_total', 'Rows written to Measurements')
+REJECTS = metrics.Counter('ingest_validation_rejects_total', 'Sensor values rejected by validation')
+BATCH_SECONDS = metrics.Histogram('ingest_batch_seconds', 'Latency of a batch write transaction')
+BATCH_SIZES = metrics.Histogram('ingest_batch_uplinks', 'Uplinks per batch', metrics.COUNT_BUCKETS)
+metrics.Gauge('ingest_queue_depth', 'Uplinks waiting in the queue', function=lambda: uplink_queue.qsize())
+metrics.Gauge('ingest_queue_capacity', 'Size of the uplink queue', function=lambda: QUEUE_MAXSIZE)
+metrics.Gauge('ingest_lag_seconds', 'Age of the oldest uplink waiting in the queue', function=lambda: queue_lag())
+
+# Heartbeat read by the API health endpoint, written every STATUS_INTERVAL
+STATUS_INTERVAL = 1.0  # seconds
+last_commit = {'time': None, 'lag': None}
+
+def enqueue_uplink(station, values, received_ts=None, block=False):
+    """Ajoute un uplink décodé à la file, en bloquant au plus ENQUEUE_TIMEOUT.
+
+    With `block`, waits as long as needed instead (replayed uplinks).
+    """
+    item = (received_ts or time.time(), station, values)
+    try:
+        uplink_queue.put_nowait(item)
+    except queue.Full:
+        UPLINKS.inc(outcome='blocked')
+        try:
+            uplink_queue.put(item, timeout=None if block else ENQUEUE_TIMEOUT)
+        except queue.Full:
+            UPLINKS.inc(outcome='dropped')
+            metrics.log_event('uplink_dropped', level='warning', station=station, queue_depth=uplink_queue.qsize())
+            return False
+    UPLINKS.inc(outcome='queued')
+    return True
+
+def queue_lag():
+    """Secondes d'attente du plus ancien uplink en file (0 si elle est vide)."""
+    with uplink_queue.mutex:
+        oldest = next((item[0] for item in uplink_queue.queue if item is not STOP), None)
+    return max(0.0, time.time() - oldest) if oldest is not None else 0.0
+
+def write_status(running=True):
+    """Battement de cœur de l'ingestion ; an unwritable file must not stop the writes."""
+    try:
+        health.write_ingest_status({
+            "pid": os.getpid(),
+            "running": running,
+            "heartbeat": time.time(),
+            "queue_depth": uplink_queue.qsize(),
+            "lag_seconds": round(queue_lag(), 3),
+            "last_commit": last_commit['time'],
+            "last_batch_lag": last_commit['lag'],
+            "dropped": UPLINKS.value(outcome='dropped'),
+        })
+    except OSError as e:
+        metrics.log_event('status_failed', level='warning', error=str(e))
+
+def write_batch(batch):
+    """Écrit un lot en réessayant ; returns False if every attempt failed."""
+    delay = RETRY_DELAY
+    for attempt in range(BATCH_RETRIES + 1):
+        start = time.perf_counter()
+        try:
+            measurements, errors = insert_uplinks_in_db(batch)
+        except Exception as e:
+            BATCHES.inc(outcome='failed')
+            metrics.log_event('batch_failed', level='warning' if attempt < BATCH_RETRIES else 'error',
+                              uplinks=len(batch), attempt=attempt + 1, error=str(e))
+            if attempt < BATCH_RETRIES:
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+            continue
+        BATCH_SECONDS.observe(time.perf_counter() - start)
+        BATCH_SIZES.observe(len(batch))
+        BATCHES.inc(outcome='ok')
+        MEASUREMENTS.inc(measurements)
+        # Reception to commit of the oldest uplink of the batch
+        last_commit['time'] = time.time()
+        last_commit['lag'] = round(last_commit['time'] - min(item[0] for item in batch), 3)
+        return True
+    return False
+
+def spill_batch(batch):
+    """Sauvegarde sur disque un lot qui n'a pas pu être écrit, one file per batch."""
+    os.makedirs(SPILL_DIR, exist_ok=True)
+    path = os.path.join(SPILL_DIR, f"batch-{time.time():.6f}-{os.getpid()}.jsonl")
+    with open(path + '.tmp', 'w') as f:
+        for received_ts, station, values in batch:
+            f.write(json.dumps({"received_ts": received_ts, "station": station, "values": values}) + "\n")
+    os.replace(path + '.tmp', path)
+    BATCHES.inc(outcome='spilled')
+    metrics.log_event('batch_spilled', level='error', uplinks=len(batch), path=path)
+
+def flush_batch(batch):
+    if not write_batch(batch):
+        spill_batch(batch)
+
+def write_spilled():
+    """Réécrit les lots sauvegardés, oldest first, until one fails again."""
+    try:
+        names = sorted(name for name in os.listdir(SPILL_DIR) if name.endswith('.jsonl'))
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(SPILL_DIR, name)
+        with open(path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        batch = [(record["received_ts"], record["station"], record["values"]) for record in records]
+        # One file is one transaction: it is removed once committed
+        if not write_batch(batch):
+            return
+        os.remove(path)
+        BATCHES.inc(outcome='unspilled')
+        metrics.log_event('batch_unspilled', uplinks=len(batch), path=path)
+
+last_report = {'time': time.monotonic(), 'messages': 0, 'measurements': 0}
+
+def report_stats():
+    """Une ligne de log structurée : débits depuis le dernier rapport et compteurs."""
+    now = time.monotonic()
+    messages, measurements = MESSAGES.value(), MEASUREMENTS.value()
+    elapsed = max(now - last_report['time'], 1e-9)
+    metrics.log_event(
+        'ingest_stats',
+        messages_per_s=round((messages - last_report['messages']) / elapsed, 2),
+        measurements_per_s=round((measurements - last_report['measurements']) / elapsed, 2),
+        queue_depth=uplink_queue.qsize(),
+        queued=UPLINKS.value(outcome='queued'),
+        blocked=UPLINKS.value(outcome='blocked'),
+        dropped=UPLINKS.value(outcome='dropped'),
+        batches=BATCHES.value(outcome='ok'),
+        failed_batches=BATCHES.value(outcome='failed'),
+        spilled_batches=BATCHES.value(outcome='spilled'),
+        validation_rejects=sum(value for _, _, value in REJECTS.samples()),
+    )
+    last_report.update(time=now, messages=messages, measurements=measurements)
+
+def writer_loop():
+    """Vide la file par lots jusqu'à recevoir STOP, puis écrit le reste."""
+    next_report = time.monotonic() + STATS_INTERVAL
+    next_status = time.monotonic()
+    write_spilled()
+    stopping = False
+    while not stopping:
+        try:
+            item = uplink_queue.get(timeout=FLUSH_INTERVAL)
+        except queue.Empty:
+            item = None
+
+        batch = []
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while item is not None:
+            if item is STOP:
+                stopping = True
+                break
+            batch.append(item)
+            if len(batch) >= BATCH_SIZE:
+                break
+            try:
+                item = uplink_queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+        if batch:
+            flush_batch(batch)
+        if time.monotonic() >= next_report:
+            write_spilled()
+            report_stats()
+            next_report = time.monotonic() + STATS_INTERVAL
+        if time.monotonic() >= next_status:
+            write_status()
+            next_status = time.monotonic() + STATUS_INTERVAL
+
+    # Drain whatever arrived before the stop marker was processed
+    batch = []
+    while True:
+        try:
+            item = uplink_queue.get_nowait()
+        except queue.Empty:
+            break
+        if item is not STOP:
+            batch.append(item)
+    for i in range(0, len(batch), BATCH_SIZE):
+        flush_batch(batch[i:i + BATCH_SIZE])
+    write_status(running=False)
+
+# ----------------------
+# Décodage des messages
+# ----------------------
+recorder = None  # JSONL file the messages are copied to (--record)
+recorder_lock = threading.Lock()
+
+def handle_message(topic, payload, received_ts=None, block=False):
+    """Décode un message TTN (JSON) et met son uplink en file."""
+    MESSAGES.inc()
     try:
         # Récupération du JSON depuis TTN
-        data = json.loads(message.payload.decode("utf-8"))
+        data = json.loads(payload) if isinstance(payload, (bytes, str)) else payload
+        received_ts = received_ts or time.time()
+        if recorder is not None:
+            with recorder_lock:
+                recorder.write(json.dumps({"topic": topic, "received_ts": received_ts, "payload": data}) + "\n")
+        station = data.get("end_device_ids", {}).get("device_id") or topic.split('/')[-2]
         uplink_msg = data.get("uplink_message", {})
         decoded = uplink_msg.get("decoded_payload", {})
 
         if not decoded:
-            print("⚠️ Aucune 'decoded_payload' dans le message.")
+            metrics.log_event('uplink_ignored', level='warning', station=station, reason='no decoded_payload')
             return
 
-        # Extraction des champs (exactement les mêmes noms que dans decodeUplink)
-        batterie  = decoded.get("batterie")
-        pression  = decoded.get("pression")
-        co2       = decoded.get("co2")
-        lum       = decoded.get("lum")
-        hum4      = decoded.get("hum4")
-        hum3      = decoded.get("hum3")
-        hum2      = decoded.get("hum2")
-        hum1      = decoded.get("hum1")
-        temp2     = decoded.get("temp2")
-        temp1     = decoded.get("temp1")
-
-        print("=== Uplink reçu (décodé par TTN) ===")
-        print(f"batterie:  {batterie}")
-        print(f"pression:  {pression}")
-        print(f"co2:       {co2}")
-        print(f"lum:       {lum}")
-        print(f"hum4:      {hum4}")
-        print(f"hum3:      {hum3}")
-        print(f"hum2:      {hum2}")
-        print(f"hum1:      {hum1}")
-        print(f"temp2:     {temp2}")
-        print(f"temp1:     {temp1}")
-        print("====================================\n")
-
-        # Insertion dans la base de données
-        insert_uplink_in_db(
-            batterie, pression, co2,
-            lum, hum4, hum3, hum2, hum1,
-            temp2, temp1
-        )
+        values = {field: decoded.get(field) for field in PAYLOAD_FIELDS}
+        metrics.log_event('uplink', level='debug', station=station, **values)
+
+        # Mise en file pour l'écriture en base par lots
+        enqueue_uplink(station, values, received_ts, block)
 
-    except json.JSONDecodeError:
-        print("❌ Erreur JSON dans le message TTN.")
+    except json.JSONDecodeError as e:
+        metrics.log_event('uplink_invalid', level='warning', topic=topic, error=str(e))
     except Exception as e:
-        print(f"❌ Erreur inattendue : {e}")
+        metrics.log_event('uplink_failed', level='error', topic=topic, error=repr(e))
 
 # ---------------
-# Configuration MQTT
+# Moteur d'ingestion
 # ---------------
-client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION1)
-client.username_pw_set(f"{app_id}@ttn", access_key)
-client.tls_set()
-client.on_connect = on_connect
-client.on_message = on_message
+writer_thread = None
 
-# Connexion au broker
-client.connect(broker, port)
-client.loop_start()
+def start_ingest():
+    """Charge le cache des capteurs et démarre le thread d'écriture."""
+    global writer_thread
+    load_device_cache()
+    writer_thread = threading.Thread(target=writer_loop, name='sqlite-writer', daemon=True)
+    writer_thread.start()
 
-try:
-    while True:
-        time.sleep(1)
-except KeyboardInterrupt:
-    print("Fermeture du script...")
+def stop_ingest():
+    """Vide la file, attend la fin des écritures et publie les statistiques."""
+    global writer_thread
+    uplink_queue.put(STOP)
+    writer_thread.join()
+    writer_thread = None
+    report_stats()
+
+def run(source, stop=None):
+    """Ingère les messages de `source` jusqu'à son épuisement, `stop` ou Ctrl+C."""
+    stop = stop or threading.Event()
+    start_ingest()
+    try:
+        source.run(handle_message, stop)
+    except KeyboardInterrupt:
+        metrics.log_event('ingest_interrupted')
+    finally:
+        # Plus de nouveaux messages, puis vidage de la file avant de fermer la base
+        stop_ingest()
+
+def build_source(args):
+    if args.source == 'replay':
+        if not args.file:
+            raise SystemExit("--file est requis avec --source replay")
+        return ReplaySource(args.file, args.speed)
+    if args.source == 'broker':
+        return MQTTSource(args.host, args.port, [(args.topic, args.username, args.password)], tls=args.tls,
+                          client_id=MQTT_CLIENT_ID)
+    return ttn_source(APPLICATIONS, broker, port, client_id=MQTT_CLIENT_ID)
+
+def main():
+    """Ingestion -> SQLite jusqu'à Ctrl+C (ou la fin d'un rejeu)."""
+    global recorder
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', choices=['ttn', 'broker', 'replay'], default='ttn')
+    parser.add_argument('--host', default='localhost', help="local broker host")
+    parser.add_argument('--port', type=int, default=1883, help="local broker port")
+    parser.add_argument('--topic', default=UPLINK_TOPIC, help="local broker topic")
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--tls', action='store_true', help="connect to the local broker with TLS")
+    parser.add_argument('--file', help="JSONL recording to replay")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed multiplier, 0 for as fast as possible")
+    parser.add_argument('--record', metavar='FILE', help="append every received message to a JSONL file")
+    args = parser.parse_args()
+
+    source = build_source(args)
+    metrics.serve(METRICS_PORT)
+    if args.record:
+        recorder = open(args.record, 'a', buffering=1)
+    # Arrêt propre sur SIGTERM (docker stop, superviseur) : même chemin que la fin d'un rejeu
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        run(source, stop)
+    finally:
+        if recorder is not None:
+            recorder.close()
+        db.close()
 
-client.loop_stop()
-client.disconnect()
-conn.close()
+if __name__ == "__main__":
+    main()
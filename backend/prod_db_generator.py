@@ -1,4 +1,5 @@
 import sqlite3, random
+from migrations import migrate
 
 def connect_db(db_path='db.db'):
     conn = sqlite3.connect(db_path)
@@ -23,7 +24,7 @@ def create_tables(c):
     c.execute("""
         CREATE TABLE IF NOT EXISTS Device (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type VARCHAR(255) NOT NULL CHECK(type IN ('temperature', 'humidity', 'temperaturesol','humidity10', 'humidity20', 'humidity30', 'co2', 'pressure', 'luminosity', 'battery'))
+            type VARCHAR(255) NOT NULL
         )
     """)
     
@@ -52,6 +53,8 @@ def main():
     create_tables(c) 
     init_capteurs(c)
     conn.commit()
+    migrate(conn)
+    conn.commit()
     conn.close()
     
 if __name__ == "__main__":
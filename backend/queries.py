@@ -0,0 +1,189 @@
+"""Query engine behind the measurement routes.
+
+Every series route is a view over `query_measurements`, which fetches any set
+of device types in a single SQL statement and returns columnar series:
+parallel `t` (timestamps) and `v` (values) arrays per device. Each series is
+keyed by its device type, or by `type:device id` when several devices (of
+different stations) of the type have data in the range, so stations are never
+mixed. Downsampled
+series are read from the Rollups table rather than from raw measurements.
+"""
+import time
+
+import rollups
+from timeutils import format_epochs, to_epoch
+
+# Bucket widths in seconds for server-side downsampling
+BUCKETS = {'5m': 300, '1h': 3600, '1d': 86400}
+
+# Value of a bucket built from rollup rows ('last' is handled separately)
+AGGREGATES = {'avg': 'SUM(r.sum) / SUM(r.count)', 'min': 'MIN(r.min)', 'max': 'MAX(r.max)'}
+
+
+def raw_query(devices, start_ts, end_ts, limit):
+    """SQL and parameters selecting raw (value, ts) rows of `devices`."""
+    where = [f"m.device IN ({', '.join('?' * len(devices))})"]
+    params = list(devices)
+    if start_ts is not None:
+        where.append("m.recorded_ts >= ?")
+        params.append(start_ts)
+    if end_ts is not None:
+        where.append("m.recorded_ts <= ?")
+        params.append(end_ts)
+    query = f"""
+        SELECT m.value AS value, m.recorded_ts AS ts
+        FROM Measurements m
+        WHERE {' AND '.join(where)}
+    """
+    if limit is not None:
+        # Most recent points only
+        query += " ORDER BY m.recorded_ts DESC LIMIT ?"
+        params.append(limit)
+    return query, params
+
+
+def rollup_query(devices, start_ts, end_ts, limit, width, agg):
+    """SQL and parameters selecting (value, ts) buckets of `width` seconds.
+
+    Buckets are merged from the coarsest rollup resolution dividing `width`;
+    the range is therefore applied at the granularity of that resolution.
+    """
+    resolution = rollups.pick_resolution(width)
+    where = ["r.resolution = ?", f"r.device IN ({', '.join('?' * len(devices))})"]
+    params = [resolution, *devices]
+    if start_ts is not None:
+        where.append("r.bucket_ts >= ?")
+        params.append(start_ts - start_ts % resolution)
+    if end_ts is not None:
+        where.append("r.bucket_ts <= ?")
+        params.append(end_ts)
+    bucket_expr = f"(r.bucket_ts / {width}) * {width}"
+    if agg == 'last':
+        # SQLite returns the bare column from the row holding MAX(...)
+        value_expr = "r.last AS value, MAX(r.last_ts) AS last_ts"
+    else:
+        value_expr = f"{AGGREGATES[agg]} AS value"
+    query = f"""
+        SELECT {value_expr}, {bucket_expr} AS ts
+        FROM Rollups r
+        WHERE {' AND '.join(where)}
+        GROUP BY {bucket_expr}
+    """
+    if limit is not None:
+        query += f" ORDER BY {bucket_expr} DESC LIMIT ?"
+        params.append(limit)
+    return query, params
+
+
+def devices_by_type(c, device_types, station=None, device=None):
+    """{device_type: [device ids]}, optionally only of one station or device."""
+    where = [f"type IN ({', '.join('?' * len(device_types))})"]
+    params = list(device_types)
+    if station is not None:
+        where.append("station = ?")
+        params.append(station)
+    if device is not None:
+        where.append("id = ?")
+        params.append(device)
+    devices = {device_type: [] for device_type in device_types}
+    for row in c.execute(f"SELECT id, type FROM Device WHERE {' AND '.join(where)} ORDER BY id", params):
+        devices[row[1]].append(row[0])
+    return devices
+
+
+def series_keys(devices, present):
+    """{device id: series key} of the devices of {device_type: [device ids]} in `present`.
+
+    Only devices with data (`present`) count: a type with data from a single
+    device keeps its name as key; otherwise each device gets its own series,
+    keyed `type:device id`.
+    """
+    keys = {}
+    for device_type, ids in devices.items():
+        ids = [device for device in ids if device in present]
+        for device in ids:
+            keys[device] = device_type if len(ids) == 1 else f"{device_type}:{device}"
+    return keys
+
+
+def width_for_points(c, devices, start_ts, end_ts, points):
+    """Bucket width serving about `points` points over the range, or None for raw data."""
+    if start_ts is None:
+        # Range starts with the oldest day of data of these devices
+        placeholders = ', '.join('?' * len(devices))
+        start_ts = c.execute(
+            f"SELECT MIN(bucket_ts) FROM Rollups WHERE resolution = ? AND device IN ({placeholders})",
+            (rollups.RESOLUTIONS[-1], *devices)
+        ).fetchone()[0]
+        if start_ts is None:
+            return None
+    end_ts = end_ts if end_ts is not None else int(time.time())
+    return rollups.resolution_for_points(end_ts - start_ts, points)
+
+
+def query_measurements(c, device_types, start=None, end=None, limit=None, bucket=None, agg='avg',
+                       time_format='local', points=None, station=None, device=None):
+    """Fetch the series of several device types in one statement.
+
+    Returns {series key: {"t": [...], "v": [...]}} in chronological order, see
+    `series_keys`; `station` or `device` only keep the devices of one station
+    or a single device.
+    When `bucket` is set, values are grouped into fixed-width time buckets and
+    reduced with `agg`; each point is then stamped with the start of its
+    bucket. Without `bucket`, `points` picks the coarsest rollup resolution
+    that still gives that many points over the range. `limit` keeps the most
+    recent points (or buckets) of each series. Timestamps are Europe/Paris
+    strings, or UTC epoch milliseconds with `time_format='epoch_ms'`.
+    """
+    start_ts = to_epoch(start) if start is not None else None
+    end_ts = to_epoch(end) if end is not None else None
+    devices = devices_by_type(c, device_types, station, device)
+    width = BUCKETS[bucket] if bucket is not None else None
+    if width is None and points is not None:
+        all_devices = [device for ids in devices.values() for device in ids]
+        if all_devices:
+            width = width_for_points(c, all_devices, start_ts, end_ts, points)
+
+    # One sub-select per device keeps each of them on the primary key or
+    # (device, recorded_ts) index and lets LIMIT apply per series
+    parts = []
+    params = []
+    for device_id in (device for ids in devices.values() for device in ids):
+        if width is None:
+            query, device_params = raw_query([device_id], start_ts, end_ts, limit)
+        else:
+            query, device_params = rollup_query([device_id], start_ts, end_ts, limit, width, agg)
+        parts.append(f"SELECT ? AS device, value, ts FROM ({query})")
+        params.extend([device_id, *device_params])
+    rows = []
+    if parts:
+        rows = c.execute(" UNION ALL ".join(parts) + " ORDER BY device, ts", params).fetchall()
+    return fill_series(devices, rows, time_format)
+
+
+def fill_series(devices, rows, time_format='local'):
+    """Columnar series of (device, value, ts) rows, keyed by `series_keys`.
+
+    Types without data get an empty series, in the order of the request.
+    """
+    keys = series_keys(devices, {row[0] for row in rows})
+    series = {}
+    for device_type, ids in devices.items():
+        present = [keys[device] for device in ids if device in keys]
+        for key in present or [device_type]:
+            series[key] = {"t": [], "v": []}
+    timestamps = [row[2] for row in rows]
+    if time_format == 'epoch_ms':
+        timestamps = [ts * 1000 for ts in timestamps]
+    else:
+        timestamps = format_epochs(timestamps)
+    for row, recorded_at in zip(rows, timestamps):
+        columns = series[keys[row[0]]]
+        columns["t"].append(recorded_at)
+        columns["v"].append(row[1])
+    return series
+
+
+def to_points(columns):
+    """Row-oriented view of a columnar series, as returned by the legacy routes."""
+    return [{"value": value, "recorded_at": recorded_at} for recorded_at, value in zip(columns["t"], columns["v"])]
@@ -0,0 +1,204 @@
+"""Retention policy: archive and delete expired raw data.
+
+Raw measurements older than `RETENTION_DAYS` are exported to one gzipped CSV
+file per UTC day under `ARCHIVE_DIR`, then deleted; charts keep being served
+from the rollups. Minute rollups and handled errors have their own retention.
+Deletes run in small transactions so that the MQTT ingest is never blocked
+for long, and freed pages are returned with incremental vacuum when the
+database has it enabled (`python retention.py --enable-incremental-vacuum`,
+once, with the other services stopped).
+
+    python retention.py [--loop]
+"""
+import argparse
+import csv
+import gzip
+import os
+import signal
+import time
+
+import db
+import health
+import rollups
+from anomalies import AnomalyDetector
+from errors import ERROR_COLUMNS
+
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', 90))
+MINUTE_ROLLUP_RETENTION_DAYS = int(os.environ.get('MINUTE_ROLLUP_RETENTION_DAYS', 365))
+ERRORS_RETENTION_DAYS = int(os.environ.get('ERRORS_RETENTION_DAYS', 90))
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 2000))
+RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', 3600))
+
+BATCH_PAUSE = 0.05       # seconds left to other writers between two batches
+VACUUM_PAGES = 1000      # pages freed per incremental vacuum step
+DAY = 86400
+
+MEASUREMENT_COLUMNS = ('id', 'device', 'value', 'recorded_at', 'recorded_ts')
+
+
+def enable_incremental_vacuum(conn):
+    """Switch the database to incremental auto-vacuum (rewrites the whole file)."""
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def incremental_vacuum(writer):
+    """Return free pages to the filesystem, a few at a time."""
+    if writer.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return
+    while writer.conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+        with writer.lock:
+            writer.conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})").fetchall()
+        time.sleep(BATCH_PAUSE)
+
+
+def delete_batches(writer, table, ids):
+    for i in range(0, len(ids), RETENTION_BATCH_SIZE):
+        batch = ids[i:i + RETENTION_BATCH_SIZE]
+        with writer.transaction() as c:
+            c.execute(f"DELETE FROM {table} WHERE id IN ({', '.join('?' * len(batch))})", batch)
+        time.sleep(BATCH_PAUSE)
+
+
+def archive_path(directory, name):
+    """A file name not used yet: re-running after a crash adds a new part."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.csv.gz")
+    part = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{name}.{part}.csv.gz")
+        part += 1
+    return path
+
+
+def write_archive(path, columns, rows):
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt', newline='') as f:
+        out = csv.writer(f)
+        out.writerow(columns)
+        out.writerows(rows)
+    os.replace(tmp_path, path)
+
+
+def catch_up_derived(writer):
+    """Fold every measurement into the rollups, anomaly state and device health before deleting it."""
+    with writer.transaction() as c:
+        AnomalyDetector().catch_up(c)
+        rollups.catch_up(c)
+        health.catch_up(c)
+
+
+def oldest_day(c, query, devices):
+    oldest = [c.execute(query, (device,)).fetchone()[0] for device in devices]
+    oldest = [ts for ts in oldest if ts is not None]
+    return min(oldest) // DAY * DAY if oldest else None
+
+
+def expire_measurements(cutoff_ts, archive_dir=ARCHIVE_DIR):
+    """Archive then delete measurements older than `cutoff_ts`, one UTC day at a time.
+
+    Returns the number of rows deleted.
+    """
+    writer = db.get_writer()
+    catch_up_derived(writer)
+    with db.read_connection() as c:
+        devices = [row[0] for row in c.execute("SELECT id FROM Device")]
+        day = oldest_day(c, "SELECT MIN(recorded_ts) FROM Measurements WHERE device = ?", devices)
+    if day is None:
+        return 0
+
+    placeholders = ', '.join('?' * len(devices))
+    deleted = 0
+    while day < cutoff_ts:
+        end = min(day + DAY, cutoff_ts)
+        with db.read_connection() as c:
+            rows = c.execute(f"""
+                SELECT {', '.join(MEASUREMENT_COLUMNS)} FROM Measurements
+                WHERE device IN ({placeholders}) AND recorded_ts >= ? AND recorded_ts < ?
+                ORDER BY recorded_ts, id
+            """, (*devices, day, end)).fetchall()
+        if rows:
+            name = time.strftime('%Y-%m-%d', time.gmtime(day))
+            write_archive(archive_path(os.path.join(archive_dir, 'measurements'), name), MEASUREMENT_COLUMNS, rows)
+            delete_batches(writer, 'Measurements', [row["id"] for row in rows])
+            deleted += len(rows)
+        day = end
+
+    # Anomalies point at the deleted rows
+    with writer.transaction() as c:
+        c.execute("DELETE FROM Anomalies WHERE recorded_ts < ?", (cutoff_ts,))
+    return deleted
+
+
+def expire_minute_rollups(cutoff_ts):
+    """Delete minute rollups older than `cutoff_ts`; hour and day rollups are kept."""
+    writer = db.get_writer()
+    with db.read_connection() as c:
+        devices = [row[0] for row in c.execute("SELECT id FROM Device")]
+        day = oldest_day(c, "SELECT MIN(bucket_ts) FROM Rollups WHERE resolution = 60 AND device = ?", devices)
+    if day is None:
+        return 0
+    deleted = 0
+    while day < cutoff_ts:
+        day = min(day + DAY, cutoff_ts)
+        with writer.transaction() as c:
+            deleted += c.execute("DELETE FROM Rollups WHERE resolution = 60 AND bucket_ts < ?", (day,)).rowcount
+        time.sleep(BATCH_PAUSE)
+    return deleted
+
+
+def expire_errors(cutoff_ts, archive_dir=ARCHIVE_DIR):
+    """Archive then delete handled errors last seen before `cutoff_ts`."""
+    with db.read_connection() as c:
+        rows = c.execute(f"""
+            SELECT {', '.join(ERROR_COLUMNS)} FROM Errors
+            WHERE handled AND last_seen < datetime(?, 'unixepoch')
+            ORDER BY id
+        """, (cutoff_ts,)).fetchall()
+    if not rows:
+        return 0
+    name = time.strftime('%Y-%m-%d', time.gmtime(cutoff_ts))
+    write_archive(archive_path(os.path.join(archive_dir, 'errors'), name), ERROR_COLUMNS, rows)
+    delete_batches(db.get_writer(), 'Errors', [row["id"] for row in rows])
+    return len(rows)
+
+
+def run_retention(now=None):
+    now = int(now if now is not None else time.time())
+    measurements = expire_measurements(now - RETENTION_DAYS * DAY)
+    minute_rollups = expire_minute_rollups(now - MINUTE_ROLLUP_RETENTION_DAYS * DAY)
+    errors = expire_errors(now - ERRORS_RETENTION_DAYS * DAY)
+    incremental_vacuum(db.get_writer())
+    print(f"Retention: {measurements} measurements, {minute_rollups} minute rollups, {errors} errors removed")
+    return measurements, minute_rollups, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--loop', action='store_true', help=f"run every RETENTION_INTERVAL seconds ({RETENTION_INTERVAL})")
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help="switch the database to incremental auto-vacuum, then exit")
+    args = parser.parse_args()
+    # SIGTERM stops the loop like Ctrl+C: the current batch is rolled back
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    try:
+        if args.enable_incremental_vacuum:
+            conn = db.connect()
+            enable_incremental_vacuum(conn)
+            conn.close()
+            return
+        while True:
+            run_retention()
+            if not args.loop:
+                break
+            time.sleep(RETENTION_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Continuous minute/hour/day rollups of Measurements.
+
+The Rollups table holds count/sum/min/max/last per device and time bucket at
+each resolution. It is maintained incrementally: `catch_up` folds the rows
+inserted since the last run (tracked by a high-water mark in Meta) into the
+existing buckets, so long-range charts read O(buckets) rows instead of every
+raw measurement. The same pass keeps LatestValues, the most recent value of
+each device, for overviews.
+"""
+
+# Rollup resolutions in seconds, finest first
+RESOLUTIONS = (60, 3600, 86400)
+
+HIGH_WATER_KEY = 'rollup_high_water'
+FETCH_SIZE = 10000
+
+UPSERT_QUERY = """
+    INSERT INTO Rollups (resolution, device, bucket_ts, count, sum, min, max, last, last_ts)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (resolution, device, bucket_ts) DO UPDATE SET
+        count = count + excluded.count,
+        sum = sum + excluded.sum,
+        min = MIN(min, excluded.min),
+        max = MAX(max, excluded.max),
+        last = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last ELSE last END,
+        last_ts = MAX(last_ts, excluded.last_ts)
+"""
+
+LATEST_QUERY = """
+    INSERT INTO LatestValues (device, value, recorded_ts)
+    VALUES (?, ?, ?)
+    ON CONFLICT (device) DO UPDATE SET
+        value = excluded.value,
+        recorded_ts = excluded.recorded_ts
+    WHERE excluded.recorded_ts >= LatestValues.recorded_ts
+"""
+
+# Latest value of each device from its day rollups, which are never expired
+LATEST_FROM_ROLLUPS_QUERY = """
+    INSERT INTO LatestValues (device, value, recorded_ts)
+    SELECT device, last, MAX(last_ts) FROM Rollups WHERE resolution = 86400 GROUP BY device
+"""
+
+
+def catch_up(c):
+    """Fold measurements newer than the high-water mark into the rollups.
+
+    Must run inside a write transaction. Returns the number of rows folded.
+    """
+    high_water = c.execute("SELECT value FROM Meta WHERE key = ?", (HIGH_WATER_KEY,)).fetchone()[0]
+    cursor = c.execute(
+        "SELECT id, device, value, recorded_ts FROM Measurements WHERE id > ? ORDER BY id",
+        (high_water,)
+    )
+    buckets = {}
+    latest = {}
+    folded = 0
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        for measurement, device, value, ts in rows:
+            high_water = measurement
+            if value is None:
+                continue
+            folded += 1
+            previous = latest.get(device)
+            if previous is None or ts >= previous[1]:
+                latest[device] = (value, ts)
+            for resolution in RESOLUTIONS:
+                key = (resolution, device, ts - ts % resolution)
+                bucket = buckets.get(key)
+                if bucket is None:
+                    buckets[key] = [1, value, value, value, value, ts]
+                    continue
+                bucket[0] += 1
+                bucket[1] += value
+                if value < bucket[2]:
+                    bucket[2] = value
+                if value > bucket[3]:
+                    bucket[3] = value
+                if ts >= bucket[5]:
+                    bucket[4] = value
+                    bucket[5] = ts
+
+    if buckets:
+        c.executemany(UPSERT_QUERY, [key + tuple(bucket) for key, bucket in buckets.items()])
+        c.executemany(LATEST_QUERY, [(device, value, ts) for device, (value, ts) in latest.items()])
+    c.execute("UPDATE Meta SET value = ? WHERE key = ?", (high_water, HIGH_WATER_KEY))
+    return folded
+
+
+def pick_resolution(width):
+    """Coarsest rollup resolution that buckets of `width` seconds can be built from."""
+    return max(resolution for resolution in RESOLUTIONS if width % resolution == 0)
+
+
+def resolution_for_points(span, points):
+    """Coarsest resolution giving at least `points` buckets over `span` seconds.
+
+    Returns None when even the finest rollup is too coarse, in which case raw
+    measurements should be used.
+    """
+    for resolution in reversed(RESOLUTIONS):
+        if span // resolution >= points:
+            return resolution
+    return None
+
+
+def rebuild(c):
+    """Recompute every rollup from Measurements in SQL, after a bulk load."""
+    c.execute("DELETE FROM Rollups")
+    c.execute("DELETE FROM LatestValues")
+    for resolution in RESOLUTIONS:
+        c.execute("""
+            INSERT INTO Rollups (resolution, device, bucket_ts, count, sum, min, max, last_ts)
+            SELECT ?, device, (recorded_ts / ?) * ?, COUNT(*), SUM(value), MIN(value), MAX(value), MAX(recorded_ts)
+            FROM Measurements
+            WHERE value IS NOT NULL
+            GROUP BY device, (recorded_ts / ?) * ?
+        """, (resolution,) + (resolution,) * 4)
+    c.execute("""
+        UPDATE Rollups SET last = (
+            SELECT m.value FROM Measurements m
+            WHERE m.device = Rollups.device AND m.recorded_ts = Rollups.last_ts
+            ORDER BY m.id DESC LIMIT 1
+        )
+    """)
+    c.execute(LATEST_FROM_ROLLUPS_QUERY)
+    c.execute(
+        "UPDATE Meta SET value = (SELECT COALESCE(MAX(id), 0) FROM Measurements) WHERE key = ?",
+        (HIGH_WATER_KEY,)
+    )
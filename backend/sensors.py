@@ -0,0 +1,58 @@
+"""Registry of the sensors of a station, one declarative entry per payload field.
+
+Each entry gives the Device type of the field, the range of valid values
+and the largest change between two consecutive values that is not reported
+as an anomaly. The lookup tables used by the ingest, the anomaly detector
+and the API are built once from it at import, so adding a sensor only takes
+a new entry here.
+"""
+
+# Payload field (as named by decodeUplink) -> sensor description.
+# `threshold` is None for sensors without anomaly detection; `night` lowers
+# the threshold below a value: (value, threshold).
+SENSORS = {
+    'temp2': {'type': 'temperature', 'min': -10, 'max': 50, 'description': 'Air temperature', 'threshold': 5.0},      # °C
+    'hum1': {'type': 'humidity', 'min': 0, 'max': 100, 'description': 'Air humidity', 'threshold': 10.0},             # %
+    'temp1': {'type': 'temperaturesol', 'min': -10, 'max': 60, 'description': 'Soil temperature', 'threshold': None},  # °C
+    'hum2': {'type': 'humidity10', 'min': 0, 'max': 100, 'description': 'Soil humidity 10cm', 'threshold': 5.0},      # %
+    'hum3': {'type': 'humidity20', 'min': 0, 'max': 100, 'description': 'Soil humidity 20cm', 'threshold': 5.0},      # %
+    'hum4': {'type': 'humidity30', 'min': 0, 'max': 100, 'description': 'Soil humidity 30cm', 'threshold': 5.0},      # %
+    'co2': {'type': 'co2', 'min': 0, 'max': 5000, 'description': 'CO2 level', 'threshold': 100.0},                    # ppm
+    'pression': {'type': 'pressure', 'min': 900, 'max': 1100, 'description': 'Atmospheric pressure', 'threshold': 5.0},  # hPa
+    'lum': {'type': 'luminosity', 'min': 0, 'max': 100000, 'description': 'Luminosity', 'threshold': 10000.0,
+            'night': (1000.0, 500.0)},                                                                                # lux
+    'batterie': {'type': 'battery', 'min': 0, 'max': 100, 'description': 'Battery level', 'threshold': 5.0},          # %
+}
+
+
+def compile_validator(sensor):
+    """Function returning the error message of an invalid value, or None."""
+    low, high = sensor['min'], sensor['max']
+    out_of_range = f"out of range ({low}-{high}) for {sensor['description']}"
+
+    def validate(value):
+        if value is None:
+            return "Value is missing"
+        if not isinstance(value, (int, float)):
+            return f"Value must be numeric, got {type(value)}"
+        if low <= value <= high:
+            return None
+        return f"Value {value} {out_of_range}"
+
+    return validate
+
+
+# Payload field -> Device type
+SENSOR_TYPES = {key: sensor['type'] for key, sensor in SENSORS.items()}
+
+# Device types, in registry order
+DEVICE_TYPES = tuple(dict.fromkeys(SENSOR_TYPES.values()))
+
+# Payload field -> validator
+VALIDATORS = {key: compile_validator(sensor) for key, sensor in SENSORS.items()}
+
+# Device type -> largest normal change between two consecutive values
+THRESHOLDS = {sensor['type']: sensor['threshold'] for sensor in SENSORS.values() if sensor['threshold'] is not None}
+
+# Device type -> (value below which `threshold` applies, threshold)
+NIGHT_THRESHOLDS = {sensor['type']: sensor['night'] for sensor in SENSORS.values() if 'night' in sensor}
@@ -1,10 +1,93 @@
-from fastapi import FastAPI
-import sqlite3
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime
-import pytz 
+from typing import Literal, Optional
+import asyncio
+import functools
+import json
+import os
+import time
 
-app = FastAPI()
+import db
+import errors
+import export
+import health
+import metrics
+import migrations
+from cache import ResponseCache
+from queries import to_points
+from sensors import DEVICE_TYPES
+from serialization import BINARY_MEDIA_TYPE, encode_series, wants_binary
+from storage import open_storage
+from stream import MeasurementStream, event_source
+from timeutils import convert_timestamp, convert_timestamps, format_epochs, to_epoch
+
+# Maximum number of blocking DB calls running at once; by default one per
+# pooled read connection so that executor threads never wait on the pool
+DB_CONCURRENCY = int(os.environ.get('DB_CONCURRENCY', db.READ_POOL_SIZE))
+
+db_executor = ThreadPoolExecutor(max_workers=DB_CONCURRENCY, thread_name_prefix='db')
+
+REQUEST_SECONDS = metrics.Histogram('api_request_seconds', 'Latency of API requests, until the response headers')
+DB_SECONDS = metrics.Histogram('api_db_seconds', 'Time spent in blocking database calls')
+DB_VM_STEPS = metrics.Histogram('api_db_vm_steps', 'Thousands of SQLite VM steps per database call, a proxy for rows scanned',
+                                metrics.COUNT_BUCKETS)
+ROWS_RETURNED = metrics.Histogram('api_rows_returned', 'Rows or points returned per database call', metrics.COUNT_BUCKETS)
+
+def timed_db_call(func, *args, **kwargs):
+    db.vm_steps.count = 0
+    with DB_SECONDS.time(function=func.__name__):
+        result = func(*args, **kwargs)
+    DB_VM_STEPS.observe(db.vm_steps.count, function=func.__name__)
+    return result
+
+async def run_db(func, *args, **kwargs):
+    """Run blocking SQLite work on the DB executor, off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(timed_db_call, func, *args, **kwargs))
+
+# Repositories of the STORAGE_BACKEND
+storage = open_storage()
+
+# Rendered responses, invalidated on every commit seen by the stream
+response_cache = ResponseCache()
+metrics.Counter('api_cache_hits_total', 'Responses served from the cache', function=lambda: response_cache.hits)
+metrics.Counter('api_cache_misses_total', 'Responses computed on a cache miss', function=lambda: response_cache.misses)
+metrics.Counter('api_cache_not_modified_total', 'Polls answered 304 Not Modified', function=lambda: response_cache.not_modified)
+
+measurement_stream = MeasurementStream(run_db, on_change=response_cache.invalidate)
+
+# Metrics of every worker, when several of them serve the API
+shared_metrics = metrics.SharedMetrics() if metrics.METRICS_DIR else None
+
+@asynccontextmanager
+async def lifespan(app):
+    await run_db(storage.measurements.sync)
+    await measurement_stream.start()
+    if shared_metrics is not None:
+        shared_metrics.start()
+    yield
+    if shared_metrics is not None:
+        shared_metrics.stop()
+    await measurement_stream.stop()
+    db_executor.shutdown(wait=True)
+    storage.close()
+    db.close()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(time.perf_counter() - start, route=route.path if route else "unmatched",
+                            method=request.method, status=response.status_code)
+    return response
 
 app.add_middleware(
     CORSMiddleware,
@@ -13,278 +96,395 @@ app.add_middleware(
     allow_methods=["*"],  
     allow_headers=["*"],  
 )
-def connect_db():
-    conn = sqlite3.connect('db.db')
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    return c, conn
-
-def disconnect_db(conn):
-    conn.commit()
-    conn.close()
-
-def convert_timestamp(timestamp_str, target_timezone='Europe/Paris'):
-    """Convert a timestamp string to the target timezone."""
-    try:
-        # Parse the timestamp (SQLite timestamps are stored in UTC by default, but without Z marker)        
-        # First, parse the timestamp as a naive datetime
-        dt = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-        
-        # Explicitly set the timezone to UTC
-        dt = dt.replace(tzinfo=pytz.UTC)
-        
-        # Now convert to target timezone
-        target_tz = pytz.timezone(target_timezone)
-        converted_dt = dt.astimezone(target_tz)
-        
-        # Format to string without timezone info
-        return converted_dt.strftime('%Y-%m-%d %H:%M:%S')
-    except Exception as e:
-        # Return original if conversion fails
-        return timestamp_str
+def series_params(
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    limit: Optional[int] = Query(None, ge=1),
+    bucket: Optional[Literal['5m', '1h', '1d']] = None,
+    agg: Literal['avg', 'min', 'max', 'last'] = 'avg',
+    time_format: Literal['local', 'epoch_ms'] = 'local',
+    points: Optional[int] = Query(None, ge=1),
+    station: Optional[str] = None,
+    device: Optional[int] = None,
+):
+    """Common query parameters of the sensor endpoints.
+
+    `from`/`to` bound the time range (ISO 8601 or epoch seconds), `limit` keeps
+    only the most recent points and `bucket`/`agg` downsample the series.
+    `time_format=epoch_ms` returns `recorded_at` as UTC epoch milliseconds
+    instead of Europe/Paris strings, leaving localization to the client.
+    Without `bucket`, `points` asks for about that many points over the range
+    and lets the server pick the rollup resolution. `station` or `device` keep
+    the series of one station or of a single device; without them, a type
+    reported by several stations gets one series per device.
+    """
+    return {"start": start, "end": end, "limit": limit, "bucket": bucket, "agg": agg, "time_format": time_format,
+            "points": points, "station": station, "device": device}
+
+def read_query(device_types, params):
+    if params["bucket"] is not None or params["points"] is not None:
+        # Downsampled series are read from the rollups
+        storage.derived.catch_up()
+    series = storage.measurements.series(device_types, **params)
+    ROWS_RETURNED.observe(sum(len(columns["t"]) for columns in series.values()), function="read_query")
+    return series
+
+def read_series(device_types, params):
+    """Legacy row-oriented series, keyed like the columnar ones."""
+    series = read_query(device_types, params)
+    return {key: to_points(columns) for key, columns in series.items()}
+
+def columnar_json(series):
+    """Serialize columnar series one at a time."""
+    yield "{"
+    for i, (key, columns) in enumerate(series.items()):
+        separator = "," if i else ""
+        yield f'{separator}{json.dumps(key)}:{json.dumps(columns, separators=(",", ":"))}'
+    yield "}"
+
+async def series_response(request, device_types, params, read=read_series, render=None):
+    """Cached series response, in the binary layout when the client accepts it."""
+    if wants_binary(request):
+        params = {**params, "time_format": "epoch_ms"}
+        return await response_cache.respond(
+            request, lambda: run_db(read_query, device_types, params),
+            render=encode_series, media_type=BINARY_MEDIA_TYPE
+        )
+    return await response_cache.respond(request, lambda: run_db(read, device_types, params), render=render)
+
+def parse_types(types):
+    device_types = list(dict.fromkeys(types.split(',')))
+    unknown = [device_type for device_type in device_types if device_type not in DEVICE_TYPES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown device types: {', '.join(unknown)}")
+    return device_types
+
+@app.get("/measurements")
+async def get_measurements(request: Request, types: str = Query(..., description="Comma-separated device types"),
+                           params: dict = Depends(series_params)):
+    """Several series in one query, as parallel `t`/`v` arrays per type."""
+    device_types = parse_types(types)
+    return await series_response(
+        request, device_types, params, read=read_query, render=lambda series: "".join(columnar_json(series))
+    )
+
+@app.get("/export")
+async def export_measurements(
+    types: str = Query(..., description="Comma-separated device types"),
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    format: Literal['csv', 'ndjson', 'parquet'] = 'csv',
+):
+    """Raw measurements of a time range as a file download, streamed in constant memory."""
+    device_types = parse_types(types)
+    if format == 'parquet' and export.pyarrow is None:
+        raise HTTPException(status_code=400, detail="Parquet export requires the pyarrow package")
+    batches = storage.measurements.export_batches(
+        device_types, to_epoch(start) if start is not None else None, to_epoch(end) if end is not None else None,
+    )
+    chunks = export.export_chunks(format, batches)
+    return StreamingResponse(chunks, media_type=export.MEDIA_TYPES[format], headers={
+        "Content-Disposition": f'attachment; filename="measurements.{format}"',
+    })
+
+def error_item(row, recorded_at, last_seen):
+    return {"id": row["id"], "device": row["device"], "error": row["error"], "handled": bool(row["handled"]),
+            "occurrences": row["occurrences"], "recorded_at": recorded_at, "last_seen": last_seen}
+
+def read_errors(where, params, cursor, limit):
+    """One page of errors and the number matching the filters."""
+    rows, next_cursor, total = storage.errors.page(where, params, cursor, limit)
+    ROWS_RETURNED.observe(len(rows), function="read_errors")
+    timestamps = convert_timestamps([row["recorded_at"] for row in rows] + [row["last_seen"] for row in rows])
+    return {
+        "items": [error_item(row, recorded_at, last_seen)
+                  for row, recorded_at, last_seen in zip(rows, timestamps, timestamps[len(rows):])],
+        "next_cursor": next_cursor,
+        "total": total,
+    }
+
+def error_params(
+    device: Optional[int] = None,
+    handled: Optional[bool] = None,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+):
+    """Filters of the error routes; the time range applies to `last_seen`."""
+    return errors.error_filters(
+        device, handled,
+        to_epoch(start) if start is not None else None, to_epoch(end) if end is not None else None,
+    )
 
 @app.get("/errors")
-async def get_errors():
-    c, conn = connect_db()
-    rows = c.execute("SELECT id, device, error, handled, recorded_at FROM Errors").fetchall()
-    disconnect_db(conn)
-    #print the first row 
-    print(rows[0]['recorded_at'])
-    print(convert_timestamp(rows[0]['recorded_at']))
-    return [{"id": row["id"], "device": row["device"], "error": row["error"], "handled": bool(row["handled"]), "recorded_at": convert_timestamp(row["recorded_at"])} for row in rows]
+async def get_errors(
+    request: Request,
+    filters: tuple = Depends(error_params),
+    cursor: Optional[int] = Query(None, description="`next_cursor` of the previous page"),
+    limit: int = Query(errors.DEFAULT_PAGE_SIZE, ge=1, le=errors.MAX_PAGE_SIZE),
+):
+    """Errors newest first, one page at a time, with their occurrence counts."""
+    where, params = filters
+    return await response_cache.respond(request, lambda: run_db(read_errors, where, params, cursor, limit))
 
-@app.put("/errors/{error_id}/toggle")
-async def toggle_error(error_id: int):
-    c, conn = connect_db()
-    c.execute("UPDATE Errors SET handled = NOT handled WHERE id = ?", (error_id,))
-    row = c.execute("SELECT id, device, error, handled, recorded_at FROM Errors WHERE id = ?", (error_id,)).fetchone()
-    disconnect_db(conn)
+class ErrorsUpdate(BaseModel):
+    handled: bool
+    ids: Optional[list[int]] = None
+
+@app.patch("/errors")
+async def patch_errors(update: ErrorsUpdate, filters: tuple = Depends(error_params)):
+    """Set `handled` on the listed ids, on every error matching the filters, or on the listed
+    ids that match the filters when both are given, in one transaction."""
+    where, params = filters
+    if update.ids is None and not where:
+        raise HTTPException(status_code=400, detail="Give ids or at least one filter")
+    updated = await run_db(storage.errors.set_handled, update.handled, update.ids, where, params)
+    response_cache.invalidate()
+    return {"updated": updated}
+
+def toggle_error_row(error_id):
+    row = storage.errors.toggle(error_id)
     if row:
-        return {"id": row["id"], "device": row["device"], "error": row["error"], "handled": bool(row["handled"]), "recorded_at": convert_timestamp(row["recorded_at"])}
+        return error_item(row, convert_timestamp(row["recorded_at"]), convert_timestamp(row["last_seen"]))
     return {"error": "Error not found"}
 
+@app.put("/errors/{error_id}/toggle")
+async def toggle_error(error_id: int):
+    result = await run_db(toggle_error_row, error_id)
+    response_cache.invalidate()
+    return result
+
 @app.get("/temperatures-humidity")
-async def get_temperatures_humidity():
-    c, conn = connect_db()
-    query = """
-        SELECT m.value, m.recorded_at, d.type 
-        FROM Measurements m 
-        JOIN Device d ON m.device = d.id 
-        WHERE d.type IN ('temperature', 'humidity')
-    """
-    rows = c.execute(query).fetchall()
-    disconnect_db(conn)
-    temperatures = []
-    humidity = []
-    for row in rows:
-        measurement = {"value": row["value"], "recorded_at": convert_timestamp(row["recorded_at"])}
-        if row["type"] == "temperature":
-            temperatures.append(measurement)
-        elif row["type"] == "humidity":
-            humidity.append(measurement)
-    return {"temperature": temperatures, "humidity": humidity}
+async def get_temperatures_humidity(request: Request, params: dict = Depends(series_params)):
+    return await series_response(request, ['temperature', 'humidity'], params)
 
 @app.get("/soil-humidity")
-async def get_soil_humidity():
-    c, conn = connect_db()
-    query = """
-        SELECT m.value, m.recorded_at, d.type 
-        FROM Measurements m 
-        JOIN Device d ON m.device = d.id 
-        WHERE d.type IN ('humidity10', 'humidity20', 'humidity30')
-    """
-    rows = c.execute(query).fetchall()
-    disconnect_db(conn)
-    humidity10 = []
-    humidity20 = []
-    humidity30 = []
-    for row in rows:
-        measurement = {"value": row["value"], "recorded_at": convert_timestamp(row["recorded_at"])}
-        if row["type"] == "humidity10":
-            humidity10.append(measurement)
-        elif row["type"] == "humidity20":
-            humidity20.append(measurement)
-        elif row["type"] == "humidity30":
-            humidity30.append(measurement)
-    return {"humidity10": humidity10, "humidity20": humidity20, "humidity30": humidity30}
+async def get_soil_humidity(request: Request, params: dict = Depends(series_params)):
+    return await series_response(request, ['humidity10', 'humidity20', 'humidity30'], params)
 
 @app.get("/luminosity")
-async def get_luminosity():
-    c, conn = connect_db()
-    query = """
-        SELECT m.value, m.recorded_at, d.type 
-        FROM Measurements m 
-        JOIN Device d ON m.device = d.id 
-        WHERE d.type = 'luminosity'
-    """
-    rows = c.execute(query).fetchall()
-    disconnect_db(conn)
-    luminosity = []
-    for row in rows:
-        measurement = {"value": row["value"], "recorded_at": convert_timestamp(row["recorded_at"])}
-        luminosity.append(measurement)
-    return {"luminosity": luminosity}
+async def get_luminosity(request: Request, params: dict = Depends(series_params)):
+    return await series_response(request, ['luminosity'], params)
 
 @app.get("/co2")
-async def get_co2():
-    c, conn = connect_db()
-    query = """
-        SELECT m.value, m.recorded_at, d.type 
-        FROM Measurements m 
-        JOIN Device d ON m.device = d.id 
-        WHERE d.type = 'co2'
-    """
-    rows = c.execute(query).fetchall()
-    disconnect_db(conn)
-    co2 = []
-    for row in rows:
-        measurement = {"value": row["value"], "recorded_at": convert_timestamp(row["recorded_at"])}
-        co2.append(measurement)
-    return {"co2": co2}
+async def get_co2(request: Request, params: dict = Depends(series_params)):
+    return await series_response(request, ['co2'], params)
 
 @app.get("/pressure")
-async def get_pressure():
-    c, conn = connect_db()
-    query = """
-        SELECT m.value, m.recorded_at, d.type 
-        FROM Measurements m 
-        JOIN Device d ON m.device = d.id 
-        WHERE d.type = 'pressure'
-    """
-    rows = c.execute(query).fetchall()
-    disconnect_db(conn)
-    pressure = []
-    for row in rows:
-        measurement = {"value": row["value"], "recorded_at": convert_timestamp(row["recorded_at"])}
-        pressure.append(measurement)
-    return {"pressure": pressure}
+async def get_pressure(request: Request, params: dict = Depends(series_params)):
+    return await series_response(request, ['pressure'], params)
 
 @app.get("/battery")
-async def get_battery():
-    c, conn = connect_db()
-    query = """
-        SELECT m.value, m.recorded_at, d.type 
-        FROM Measurements m 
-        JOIN Device d ON m.device = d.id 
-        WHERE d.type = 'battery'
-    """
-    rows = c.execute(query).fetchall()
-    disconnect_db(conn)
-    battery = []
-    for row in rows:
-        measurement = {"value": row["value"], "recorded_at": convert_timestamp(row["recorded_at"])}
-        battery.append(measurement)
-    return {"battery": battery}
+async def get_battery(request: Request, params: dict = Depends(series_params)):
+    return await series_response(request, ['battery'], params)
+
+def detect_abnormal_changes():
+    """Abnormal changes of the last 24 hours, after checking any new rows."""
+    storage.derived.catch_up()
+    rows = storage.derived.recent_anomalies(int(time.time()) - 86400)
+    timestamps = format_epochs([row["recorded_ts"] for row in rows])
+    return {"abnormal_changes": [
+        {
+            "device": row["device"],
+            "device_type": row["device_type"],
+            "previous_value": row["previous_value"],
+            "current_value": row["current_value"],
+            "difference": row["difference"],
+            "threshold": row["threshold"],
+            "recorded_at": recorded_at
+        }
+        for row, recorded_at in zip(rows, timestamps)
+    ]}
 
 @app.get("/check-abnormal-measurements")
 async def check_abnormal_measurements():
-    c, conn = connect_db()
-    
-    # Define thresholds for different measurement types
-    thresholds = {
-        'temperature': 5.0,  # ±5°C
-        'humidity': 10.0,    # ±10%
-        'humidity10': 5.0,   # ±5%
-        'humidity20': 5.0,   # ±5%
-        'humidity30': 5.0,   # ±5%
-        'co2': 100.0,        # ±100ppm
-        'luminosity': 10000.0, # ±10,000 lux (day)
-        'pressure': 5.0,     # ±5hPa
-        'battery': 5.0       # ±5%
+    return await run_db(detect_abnormal_changes)
+
+@app.get("/temperaturesol")
+async def get_temperaturesol(request: Request, params: dict = Depends(series_params)):
+    return await series_response(request, ['temperaturesol'], params)
+
+def read_summary(time_format):
+    """Latest value of every device and error counts, without scanning Measurements."""
+    storage.derived.catch_up()
+    rows = storage.devices.latest()
+    total, unhandled, occurrences = storage.errors.counts()
+    timestamps = [row["recorded_ts"] for row in rows]
+    timestamps = [ts * 1000 for ts in timestamps] if time_format == 'epoch_ms' else format_epochs(timestamps)
+    devices = [
+        {"device": row["device"], "type": row["type"], "station": row["station"], "value": row["value"],
+         "recorded_at": recorded_at}
+        for row, recorded_at in zip(rows, timestamps)
+    ]
+    return {
+        # Rows are ordered by time: the last device of a type is its most recent
+        "latest": {device["type"]: device for device in devices},
+        "devices": devices,
+        "errors": {"total": total, "unhandled": unhandled, "occurrences": occurrences},
     }
-    
-    # Special case for luminosity at night (lower threshold)
-    night_luminosity_threshold = 500.0  # ±500 lux (night)
-    
-    # Get measurements from the last 24 hours
-    query = """
-        SELECT m.device, m.value, m.recorded_at, d.type 
-        FROM Measurements m 
-        JOIN Device d ON m.device = d.id 
-        WHERE m.recorded_at >= datetime('now', '-1 day')
-        ORDER BY d.type, m.recorded_at
-    """
-    rows = c.execute(query).fetchall()
-    
-    # Group measurements by device type
-    measurements_by_type = {}
-    for row in rows:
-        device_type = row["type"]
-        if device_type not in measurements_by_type:
-            measurements_by_type[device_type] = []
-        
-        measurements_by_type[device_type].append({
+
+@app.get("/summary")
+async def get_summary(request: Request, time_format: Literal['local', 'epoch_ms'] = 'local'):
+    """Current readings and error counts for overviews, in O(devices)."""
+    return await response_cache.respond(request, lambda: run_db(read_summary, time_format))
+
+def format_times(timestamps, time_format):
+    """Epochs (None kept) as API timestamps."""
+    if time_format == 'epoch_ms':
+        return [ts * 1000 if ts is not None else None for ts in timestamps]
+    known = [ts for ts in timestamps if ts is not None]
+    formatted = iter(format_epochs(known))
+    return [next(formatted) if ts is not None else None for ts in timestamps]
+
+def read_device_health(station, status, time_format):
+    """Liveness of every device and battery trend of every station, in O(devices)."""
+    storage.derived.catch_up()
+    now = int(time.time())
+    rows, trends = storage.devices.health(now, station)
+    last_seen = format_times([row["last_seen_ts"] for row in rows], time_format)
+    gap_times = format_times([ts for row in rows for ts in (row["last_gap_start_ts"], row["last_gap_end_ts"])], time_format)
+    devices = []
+    stations = {}
+    for i, row in enumerate(rows):
+        device_status = health.status(row, now)
+        span = row["last_seen_ts"] - row["first_seen_ts"] if row["last_seen_ts"] is not None else 0
+        device = {
             "device": row["device"],
-            "value": row["value"],
-            "recorded_at": convert_timestamp(row["recorded_at"])
-        })
-    
-    # Check for abnormal changes
-    abnormal_changes = []
-    for device_type, measurements in measurements_by_type.items():
-        if device_type not in thresholds or len(measurements) < 2:
-            continue
-        
-        threshold = thresholds[device_type]
-        
-        for i in range(1, len(measurements)):
-            prev_measurement = measurements[i-1]
-            curr_measurement = measurements[i]
-            
-            # Special case for luminosity (day/night)
-            if device_type == 'luminosity':
-                # If current value is low (night), use night threshold
-                if curr_measurement["value"] < 1000:
-                    threshold = night_luminosity_threshold
-                else:
-                    threshold = thresholds[device_type]
-            
-            # Calculate absolute difference
-            diff = abs(curr_measurement["value"] - prev_measurement["value"])
-            
-            # Check if difference exceeds threshold
-            if diff > threshold:
-                error_message = f"Abnormal change detected: {prev_measurement['value']} to {curr_measurement['value']} (diff: {diff}, threshold: {threshold})"
-                
-                # Check if this error already exists
-                existing_error = c.execute(
-                    "SELECT id FROM Errors WHERE device = ? AND error = ? AND recorded_at >= datetime('now', '-1 day')",
-                    (curr_measurement["device"], error_message)
-                ).fetchone()
-                
-                if not existing_error:
-                    # Insert new error
-                    c.execute(
-                        "INSERT INTO Errors (device, error) VALUES (?, ?)",
-                        (curr_measurement["device"], error_message)
-                    )
-                    
-                    abnormal_changes.append({
-                        "device": curr_measurement["device"],
-                        "device_type": device_type,
-                        "previous_value": prev_measurement["value"],
-                        "current_value": curr_measurement["value"],
-                        "difference": diff,
-                        "threshold": threshold,
-                        "recorded_at": convert_timestamp(curr_measurement["recorded_at"])
-                    })
-    
-    disconnect_db(conn)
-    return {"abnormal_changes": abnormal_changes}
+            "type": row["type"],
+            "station": row["station"],
+            "status": device_status,
+            "last_seen": last_seen[i],
+            "silent_for": now - row["last_seen_ts"] if row["last_seen_ts"] is not None else None,
+            "expected_interval": round(row["expected_interval"], 1) if row["expected_interval"] is not None else None,
+            "readings": row["readings"] or 0,
+            "gaps": row["gaps"] or 0,
+            "gap_seconds": row["gap_seconds"] or 0,
+            "availability": round(1 - row["gap_seconds"] / span, 4) if span else None,
+            "last_gap": {"start": gap_times[2 * i], "end": gap_times[2 * i + 1]}
+                        if row["last_gap_start_ts"] is not None else None,
+        }
+        summary = stations.setdefault(row["station"], {"station": row["station"], "devices": 0, "down": 0,
+                                                       "last_seen": None, "battery": None})
+        summary["devices"] += 1
+        summary["down"] += device_status == 'down'
+        if row["last_seen_ts"] is not None and (summary["last_seen"] is None or row["last_seen_ts"] > summary["last_seen"][0]):
+            summary["last_seen"] = (row["last_seen_ts"], last_seen[i])
+        if row["device"] in trends:
+            level, slope = trends[row["device"]]
+            days = health.days_to_low(level, slope)
+            summary["battery"] = {
+                "device": row["device"],
+                "level": level,
+                "trend_per_day": round(slope, 3) if slope is not None else None,
+                "days_to_low": round(days, 1) if days is not None else None,
+            }
+        if status is None or device_status == status:
+            devices.append(device)
+    for summary in stations.values():
+        summary["status"] = ('unknown' if summary["last_seen"] is None else
+                             'down' if summary["down"] == summary["devices"] else
+                             'degraded' if summary["down"] else 'ok')
+        summary["last_seen"] = summary["last_seen"][1] if summary["last_seen"] is not None else None
+    return {"stations": list(stations.values()), "devices": devices}
 
-@app.get("/temperaturesol")
-async def get_temperaturesol():
-    c, conn = connect_db()
-    query = """
-        SELECT m.value, m.recorded_at, d.type 
-        FROM Measurements m 
-        JOIN Device d ON m.device = d.id 
-        WHERE d.type = 'temperaturesol'
+@app.get("/devices/health")
+async def get_device_health(
+    station: Optional[str] = None,
+    status: Optional[Literal['ok', 'down', 'unknown']] = None,
+    time_format: Literal['local', 'epoch_ms'] = 'local',
+):
+    """Last reading, expected interval and gaps of every device.
+
+    Not cached: a silent device changes status without any write.
+    """
+    return await run_db(read_device_health, station, status, time_format)
+
+@app.get("/devices/{device}/gaps")
+async def get_device_gaps(
+    device: int,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    limit: int = Query(100, ge=1, le=errors.MAX_PAGE_SIZE),
+    time_format: Literal['local', 'epoch_ms'] = 'local',
+):
+    """Reporting gaps of a device overlapping the range, newest first."""
+    rows = await run_db(
+        storage.devices.gaps, device,
+        to_epoch(start) if start is not None else None, to_epoch(end) if end is not None else None, limit,
+    )
+    times = format_times([ts for row in rows for ts in (row["start_ts"], row["end_ts"])], time_format)
+    return {"device": device, "gaps": [
+        {"start": times[2 * i], "end": times[2 * i + 1], "seconds": row["end_ts"] - row["start_ts"]}
+        for i, row in enumerate(rows)
+    ]}
+
+def read_health():
+    """Database reachability and ingest lag, from this worker's point of view."""
+    now = time.time()
+    # Rows not yet folded into the anomaly state, rollups or device health
+    version, pending, newest_ts = storage.derived.status()
+    database = {
+        "schema_version": version,
+        "up_to_date": version == migrations.LATEST_VERSION,
+        "pending_rows": pending,
+        "newest_measurement_age": round(now - newest_ts, 1) if newest_ts is not None else None,
+    }
+
+    status = health.read_ingest_status()
+    if status is None:
+        ingest = {"running": False, "heartbeat_age": None}
+    else:
+        heartbeat_age = now - status["heartbeat"]
+        ingest = {
+            "running": status["running"] and heartbeat_age <= health.INGEST_STALE_SECONDS,
+            "heartbeat_age": round(heartbeat_age, 1),
+            "pid": status["pid"],
+            "queue_depth": status["queue_depth"],
+            "lag_seconds": status["lag_seconds"],
+            "last_commit_age": round(now - status["last_commit"], 1) if status["last_commit"] is not None else None,
+            "last_batch_lag": status["last_batch_lag"],
+            "dropped": status["dropped"],
+        }
+    healthy = ingest["running"] and ingest["lag_seconds"] <= health.INGEST_MAX_LAG and database["up_to_date"]
+    return {"status": "ok" if healthy else "degraded", "worker": os.getpid(), "database": database, "ingest": ingest}
+
+@app.get("/health")
+async def get_health(response: Response):
+    """Liveness of the API, its database and the ingest.
+
+    `degraded` (ingest stopped or lagging, schema behind) still answers 200:
+    the API itself serves requests. Only an unreachable database gives 503.
+    """
+    try:
+        return await run_db(read_health)
+    except Exception as e:
+        response.status_code = 503
+        return {"status": "down", "worker": os.getpid(), "error": str(e)}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics of this API process, or of every worker with METRICS_DIR."""
+    body = await asyncio.to_thread(shared_metrics.render) if shared_metrics is not None else metrics.render()
+    return Response(body, media_type=metrics.CONTENT_TYPE)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters of the response cache."""
+    return response_cache.stats()
+
+@app.get("/stream")
+async def stream_measurements(request: Request, since: Optional[int] = None, types: Optional[str] = None):
+    """Server-sent events pushing new measurements as they are committed.
+
+    `since` (or the Last-Event-ID header sent by a reconnecting EventSource)
+    is a measurement id: rows after it are replayed before the live feed.
+    `types` is an optional comma-separated list of device types.
     """
-    rows = c.execute(query).fetchall()
-    disconnect_db(conn)
-    temperaturesol = []
-    for row in rows:
-        measurement = {"value": row["value"], "recorded_at": convert_timestamp(row["recorded_at"])}
-        temperaturesol.append(measurement)
-    return {"temperaturesol": temperaturesol}
\ No newline at end of file
+    last_event_id = request.headers.get("last-event-id")
+    if since is None and last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    device_types = set(types.split(',')) if types else None
+    return StreamingResponse(
+        event_source(measurement_stream, since, device_types, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
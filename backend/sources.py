@@ -0,0 +1,143 @@
+"""Sources of uplinks for the ingest engine of `mqtt_adder.py`.
+
+A source calls `handle(topic, payload, received_ts=None, block=False)` for
+every message, where `payload` is the TTN uplink JSON, and returns once it is
+exhausted or `stop` is set:
+
+- `MQTTSource` follows topics of an MQTT broker: The Things Network
+  (`ttn_source`) or a local broker such as mosquitto;
+- `ReplaySource` replays a JSONL recording at a chosen speed, keeping the
+  original reception times, to benchmark the ingest or backfill history.
+"""
+import json
+import re
+import time
+from datetime import datetime
+
+import paho.mqtt.client as mqtt
+
+import metrics
+
+# Topic of the uplinks of every end device, on TTN and on a local bridge
+UPLINK_TOPIC = "v3/+/devices/+/up"
+
+
+class MQTTSource:
+    """Messages of an MQTT broker, one client per (topic, username, password).
+
+    With a `client_id`, the clients use persistent sessions (`{client_id}-{n}`)
+    and subscribe with QoS 1, so that a broker keeping sessions queues the
+    uplinks published while the ingest restarts.
+    """
+
+    def __init__(self, host, port, subscriptions, tls=False, client_id=None):
+        self.host = host
+        self.port = port
+        self.subscriptions = subscriptions
+        self.tls = tls
+        self.client_id = client_id
+
+    def _client(self, index, topic, username, password, handle):
+        qos = 0 if self.client_id is None else 1
+
+        def on_connect(client, userdata, flags, reason_code, properties=None):
+            if reason_code == 0:
+                metrics.log_event('mqtt_connected', host=self.host, port=self.port)
+                client.subscribe(topic, qos)
+                metrics.log_event('mqtt_subscribed', topic=topic, qos=qos)
+            else:
+                metrics.log_event('mqtt_connect_failed', level='error', host=self.host, port=self.port,
+                                  reason_code=str(reason_code))
+
+        def on_message(client, userdata, message):
+            handle(message.topic, message.payload)
+
+        if self.client_id is None:
+            client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION1)
+        else:
+            client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION1,
+                                 client_id=f"{self.client_id}-{index}", clean_session=False)
+        if username is not None:
+            client.username_pw_set(username, password)
+        if self.tls:
+            client.tls_set()
+        client.on_connect = on_connect
+        client.on_message = on_message
+        return client
+
+    def run(self, handle, stop):
+        clients = [self._client(i, topic, username, password, handle)
+                   for i, (topic, username, password) in enumerate(self.subscriptions)]
+        try:
+            for client in clients:
+                client.connect(self.host, self.port)
+                client.loop_start()
+            while not stop.wait(1):
+                pass
+        finally:
+            for client in clients:
+                client.loop_stop()
+                client.disconnect()
+
+
+def ttn_source(applications, host, port, client_id=None):
+    """Every end device of the given (app_id, access_key) TTN applications."""
+    return MQTTSource(
+        host, port,
+        [(f"v3/{app_id}@ttn/devices/+/up", f"{app_id}@ttn", access_key) for app_id, access_key in applications],
+        tls=True,
+        client_id=client_id,
+    )
+
+
+def parse_ttn_time(value):
+    """Epoch seconds of a TTN RFC 3339 timestamp (nanosecond precision)."""
+    value = re.sub(r"(\.\d{6})\d+", r"\1", value).replace("Z", "+00:00")
+    return datetime.fromisoformat(value).timestamp()
+
+
+def parse_record(record):
+    """(topic, payload, received_ts) of a recorded line.
+
+    Lines are either written by `mqtt_adder.py --record` ({"topic",
+    "received_ts", "payload"}) or raw TTN uplink messages, such as those
+    exported by the TTN storage integration.
+    """
+    if "payload" in record:
+        return record["topic"], record["payload"], record.get("received_ts")
+    ids = record.get("end_device_ids", {})
+    app_id = ids.get("application_ids", {}).get("application_id", "replay")
+    topic = f"v3/{app_id}@ttn/devices/{ids.get('device_id')}/up"
+    received_at = record.get("received_at") or record.get("uplink_message", {}).get("received_at")
+    return topic, record, parse_ttn_time(received_at) if received_at else None
+
+
+class ReplaySource:
+    """Uplinks of a JSONL recording, replayed `speed` times faster than recorded.
+
+    `speed=0` replays as fast as the ingest accepts them. Uplinks keep their
+    recorded reception time, and the queue blocks instead of dropping them.
+    """
+
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+
+    def run(self, handle, stop):
+        start = time.monotonic()
+        first_ts = None
+        with open(self.path) as f:
+            for line in f:
+                if stop.is_set():
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                topic, payload, received_ts = parse_record(json.loads(line))
+                if self.speed > 0 and received_ts is not None:
+                    if first_ts is None:
+                        first_ts = received_ts
+                    delay = (received_ts - first_ts) / self.speed - (time.monotonic() - start)
+                    if delay > 0 and stop.wait(delay):
+                        break
+                handle(topic, payload, received_ts=received_ts, block=True)
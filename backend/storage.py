@@ -0,0 +1,320 @@
+"""Storage backends: repositories for devices, errors and measurements.
+
+The API reaches the database through the repositories of a `Storage`: devices,
+errors, measurements and the state derived from them (anomalies, rollups,
+device health). Measurements are read from a backend chosen with
+`STORAGE_BACKEND`:
+
+- `sqlite` (default): everything is read from the SQLite database of `db.py`;
+- `duckdb`: series and exports are read from a columnar DuckDB copy of
+  Measurements (`DUCKDB_PATH`), synced incrementally from SQLite by id.
+  Devices, errors and every write stay on SQLite, the database shared with
+  the ingest. Needs the optional `duckdb` and `pyarrow` packages.
+
+Retention does not apply to the DuckDB copy: it keeps the raw history since
+it was created, and ranges starting before that are served by SQLite.
+"""
+import os
+import threading
+
+import anomalies
+import db
+import errors
+import export
+import health
+import migrations
+import rollups
+from queries import BUCKETS, devices_by_type, fill_series, query_measurements, width_for_points
+from timeutils import format_epochs, to_epoch
+
+try:
+    import duckdb
+    import pyarrow
+except ImportError:
+    duckdb = None
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'sqlite')
+DUCKDB_PATH = os.environ.get('DUCKDB_PATH', 'measurements.duckdb')
+
+SYNC_BATCH_SIZE = 100000
+DAY = 86400
+
+# Value of a bucket computed from raw rows
+DUCKDB_AGGREGATES = {'avg': 'AVG(value)', 'min': 'MIN(value)', 'max': 'MAX(value)',
+                     'last': 'ARG_MAX(value, recorded_ts)'}
+
+
+class DeviceRepository:
+    def latest(self):
+        """Devices with their latest value, oldest reading first (one row per device)."""
+        with db.read_connection() as c:
+            return c.execute("""
+                SELECT d.id AS device, d.type, d.station, l.value, l.recorded_ts
+                FROM LatestValues l
+                JOIN Device d ON d.id = l.device
+                ORDER BY l.recorded_ts, d.id
+            """).fetchall()
+
+    def health(self, now, station=None):
+        """(health rows, battery trends) of every device, see `health.py`."""
+        with db.read_connection() as c:
+            return health.device_health(c, station), health.battery_trends(c, now, station)
+
+    def gaps(self, device, start_ts=None, end_ts=None, limit=100):
+        with db.read_connection() as c:
+            return health.device_gaps(c, device, start_ts, end_ts, limit)
+
+
+class ErrorRepository:
+    def page(self, where, params, cursor, limit):
+        """(rows, next_cursor, total) of one page of the errors matching the filters."""
+        with db.read_connection() as c:
+            rows = c.execute(*errors.page_query(where, params, cursor, limit)).fetchall()
+            total = c.execute(*errors.count_query(where, params)).fetchone()[0]
+        next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+        return rows[:limit], next_cursor, total
+
+    def counts(self):
+        """(errors, unhandled, occurrences) over every device, from the counters table."""
+        with db.read_connection() as c:
+            return tuple(c.execute(
+                "SELECT COALESCE(SUM(errors), 0), COALESCE(SUM(unhandled), 0), COALESCE(SUM(occurrences), 0) FROM ErrorCounts"
+            ).fetchone())
+
+    def set_handled(self, handled, ids=None, where=(), params=()):
+        with db.get_writer().transaction() as c:
+            return errors.set_handled(c, handled, ids, where, params)
+
+    def toggle(self, error_id):
+        """The toggled error row, or None if there is no such error."""
+        with db.get_writer().transaction() as c:
+            return c.execute(
+                f"UPDATE Errors SET handled = NOT handled WHERE id = ? RETURNING {', '.join(errors.ERROR_COLUMNS)}",
+                (error_id,)
+            ).fetchone()
+
+
+class DerivedRepository:
+    """Anomalies, rollups and device health, maintained from Measurements.
+
+    The ingest keeps them up to date for every batch it writes; `catch_up`
+    covers rows written by other means, such as the database generators.
+    """
+
+    HIGH_WATER_KEYS = (anomalies.HIGH_WATER_KEY, rollups.HIGH_WATER_KEY, health.HIGH_WATER_KEY)
+
+    def __init__(self):
+        self.detector = anomalies.AnomalyDetector()
+
+    def catch_up(self):
+        """Fold the measurements not yet seen into the derived tables."""
+        with db.read_connection() as c:
+            pending = c.execute(
+                "SELECT (SELECT MAX(id) FROM Measurements) > MIN(value) FROM Meta WHERE key IN (?, ?, ?)",
+                self.HIGH_WATER_KEYS
+            ).fetchone()[0]
+        if pending:
+            with db.get_writer().transaction() as c:
+                self.detector.catch_up(c)
+                rollups.catch_up(c)
+                health.catch_up(c)
+
+    def recent_anomalies(self, since_ts):
+        with db.read_connection() as c:
+            return anomalies.recent_anomalies(c, since_ts)
+
+    def status(self):
+        """(schema version, measurements not yet folded in, newest measurement ts)."""
+        with db.read_connection() as c:
+            version = migrations.get_version(c)
+            pending, newest_ts = c.execute("""
+                SELECT COALESCE((SELECT MAX(id) FROM Measurements), 0) - MIN(value),
+                       (SELECT MAX(recorded_ts) FROM LatestValues)
+                FROM Meta WHERE key IN (?, ?, ?)
+            """, self.HIGH_WATER_KEYS).fetchone()
+        return version, max(pending or 0, 0), newest_ts
+
+
+class MeasurementRepository:
+    """Raw measurements and rollups of the SQLite database."""
+
+    def sync(self):
+        return 0
+
+    def series(self, device_types, **params):
+        """Columnar series, see `queries.query_measurements`."""
+        with db.read_connection() as c:
+            return query_measurements(c, device_types, **params)
+
+    def export_batches(self, device_types, start_ts=None, end_ts=None):
+        return export.export_batches(device_types, start_ts, end_ts)
+
+    def close(self):
+        pass
+
+
+class DuckDBMeasurementRepository(MeasurementRepository):
+    """Measurements read from a columnar DuckDB copy, synced from SQLite by id.
+
+    Downsampled series are aggregated from the raw rows at query time, so
+    buckets of any width are exact without rollups.
+    """
+
+    def __init__(self, path=DUCKDB_PATH):
+        if duckdb is None:
+            raise RuntimeError("STORAGE_BACKEND=duckdb requires the duckdb and pyarrow packages")
+        self.conn = duckdb.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS measurements (
+                id BIGINT,
+                device INTEGER,
+                value DOUBLE,
+                recorded_ts BIGINT
+            )
+        """)
+        self.lock = threading.Lock()
+        self.high_water, self.oldest_ts = self.conn.execute(
+            "SELECT COALESCE(MAX(id), 0), MIN(recorded_ts) FROM measurements"
+        ).fetchone()
+
+    def sync(self):
+        """Copy the rows committed to SQLite since the last sync."""
+        copied = 0
+        with self.lock, db.read_connection() as c:
+            if (c.execute("SELECT MAX(id) FROM Measurements").fetchone()[0] or 0) <= self.high_water:
+                return 0
+            cursor = c.execute(
+                "SELECT id, device, value, recorded_ts FROM Measurements WHERE id > ? ORDER BY id",
+                (self.high_water,)
+            )
+            while rows := cursor.fetchmany(SYNC_BATCH_SIZE):
+                ids, devices, values, timestamps = zip(*rows)
+                # Arrow batches are copied column by column, far faster than
+                # row inserts
+                self.conn.register('sync_batch', pyarrow.table({
+                    'id': pyarrow.array(ids, pyarrow.int64()),
+                    'device': pyarrow.array(devices, pyarrow.int32()),
+                    'value': pyarrow.array(values, pyarrow.float64()),
+                    'recorded_ts': pyarrow.array(timestamps, pyarrow.int64()),
+                }))
+                self.conn.execute("INSERT INTO measurements SELECT * FROM sync_batch")
+                self.conn.unregister('sync_batch')
+                self.high_water = ids[-1]
+                copied += len(rows)
+            if self.oldest_ts is None:
+                self.oldest_ts = self.conn.execute("SELECT MIN(recorded_ts) FROM measurements").fetchone()[0]
+        return copied
+
+    def covers(self, c, start_ts):
+        """Whether the copy holds every raw row from `start_ts` on (all of them when None)."""
+        if self.oldest_ts is None:
+            return False
+        if start_ts is not None and start_ts >= self.oldest_ts:
+            return True
+        # The day rollups keep the first day of the whole history
+        first_day = c.execute("SELECT MIN(bucket_ts) FROM Rollups WHERE resolution = ?", (DAY,)).fetchone()[0]
+        return first_day is None or first_day >= self.oldest_ts - self.oldest_ts % DAY
+
+    @staticmethod
+    def range_filter(devices, start_ts, end_ts):
+        where = [f"device IN ({', '.join('?' * len(devices))})"]
+        params = list(devices)
+        if start_ts is not None:
+            where.append("recorded_ts >= ?")
+            params.append(start_ts)
+        if end_ts is not None:
+            where.append("recorded_ts <= ?")
+            params.append(end_ts)
+        return ' AND '.join(where), params
+
+    def series(self, device_types, start=None, end=None, limit=None, bucket=None, agg='avg',
+               time_format='local', points=None, station=None, device=None):
+        self.sync()
+        start_ts = to_epoch(start) if start is not None else None
+        end_ts = to_epoch(end) if end is not None else None
+        with db.read_connection() as c:
+            if not self.covers(c, start_ts):
+                return query_measurements(c, device_types, start, end, limit, bucket, agg, time_format, points,
+                                          station, device)
+            devices = devices_by_type(c, device_types, station, device)
+            width = BUCKETS[bucket] if bucket is not None else None
+            if width is None and points is not None:
+                all_devices = [device for ids in devices.values() for device in ids]
+                if all_devices:
+                    width = width_for_points(c, all_devices, start_ts, end_ts, points)
+
+        parts = []
+        params = []
+        for device_id in (device for ids in devices.values() for device in ids):
+            where, device_params = self.range_filter([device_id], start_ts, end_ts)
+            if width is None:
+                query = f"SELECT value, recorded_ts AS ts FROM measurements WHERE {where}"
+            else:
+                query = f"""
+                    SELECT {DUCKDB_AGGREGATES[agg]} AS value, recorded_ts // {width} * {width} AS ts
+                    FROM measurements WHERE {where} GROUP BY ts
+                """
+            if limit is not None:
+                query += " ORDER BY ts DESC LIMIT ?"
+                device_params.append(limit)
+            parts.append(f"SELECT ?::INTEGER AS device, value, ts FROM ({query})")
+            params.extend([device_id, *device_params])
+        rows = []
+        if parts:
+            cursor = self.conn.cursor()
+            try:
+                rows = cursor.execute(" UNION ALL ".join(parts) + " ORDER BY device, ts", params).fetchall()
+            finally:
+                cursor.close()
+        return fill_series(devices, rows, time_format)
+
+    def export_batches(self, device_types, start_ts=None, end_ts=None):
+        self.sync()
+        with db.read_connection() as c:
+            covered = self.covers(c, start_ts)
+            placeholders = ', '.join('?' * len(device_types))
+            devices = {row["id"]: (row["type"], row["station"]) for row in c.execute(
+                f"SELECT id, type, station FROM Device WHERE type IN ({placeholders})", device_types
+            )}
+        if not covered:
+            yield from super().export_batches(device_types, start_ts, end_ts)
+            return
+        if not devices:
+            return
+        where, params = self.range_filter(list(devices), start_ts, end_ts)
+        cursor = self.conn.cursor()
+        try:
+            result = cursor.execute(
+                f"SELECT id, device, value, recorded_ts FROM measurements WHERE {where} ORDER BY device, recorded_ts",
+                params
+            )
+            while rows := result.fetchmany(export.EXPORT_FETCH_SIZE):
+                timestamps = format_epochs([row[3] for row in rows])
+                yield [(row[0], *devices[row[1]], row[1], row[2], recorded_at, row[3])
+                       for row, recorded_at in zip(rows, timestamps)]
+        finally:
+            cursor.close()
+
+    def close(self):
+        self.conn.close()
+
+
+class Storage:
+    def __init__(self, devices, errors, measurements, derived):
+        self.devices = devices
+        self.errors = errors
+        self.measurements = measurements
+        self.derived = derived
+
+    def close(self):
+        self.measurements.close()
+
+
+def open_storage(backend=STORAGE_BACKEND):
+    if backend == 'sqlite':
+        measurements = MeasurementRepository()
+    elif backend == 'duckdb':
+        measurements = DuckDBMeasurementRepository()
+    else:
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    return Storage(DeviceRepository(), ErrorRepository(), measurements, DerivedRepository())
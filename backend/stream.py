@@ -0,0 +1,178 @@
+"""Live feed of new measurements for the `/stream` server-sent events route.
+
+A single background task per API process watches the database for commits
+made by other connections (the MQTT ingest) with `PRAGMA data_version`, which
+costs no table read. When it changes, the rows newer than the last id seen are
+fetched once and fanned out to every subscribed client. Any other change
+(e.g. to Errors) is reported through the `on_change` callback.
+"""
+import asyncio
+import json
+
+import db
+import metrics
+from timeutils import format_epochs
+
+POLL_INTERVAL = 1.0         # seconds between two data_version checks
+SUBSCRIBER_QUEUE_SIZE = 100  # batches buffered per client before it is dropped
+RESUME_LIMIT = 10000        # rows replayed at most for a resume cursor
+KEEPALIVE_INTERVAL = 15.0   # seconds between two SSE comments on an idle stream
+
+NEW_ROWS_QUERY = """
+    SELECT m.id, m.device, d.type, m.value, m.recorded_ts
+    FROM Measurements m
+    JOIN Device d ON m.device = d.id
+    WHERE m.id > ?
+    ORDER BY m.id
+    LIMIT ?
+"""
+
+
+def fetch_rows_after(c, last_id, limit=RESUME_LIMIT):
+    """Measurements with an id above `last_id`, as JSON-ready dicts."""
+    rows = c.execute(NEW_ROWS_QUERY, (last_id, limit)).fetchall()
+    timestamps = format_epochs([row["recorded_ts"] for row in rows])
+    return [
+        {"id": row["id"], "device": row["device"], "type": row["type"], "value": row["value"],
+         "recorded_at": recorded_at, "recorded_ts": row["recorded_ts"]}
+        for row, recorded_at in zip(rows, timestamps)
+    ]
+
+
+def read_rows_after(last_id):
+    with db.read_connection() as c:
+        return fetch_rows_after(c, last_id)
+
+
+class MeasurementStream:
+    """Fans out newly committed measurements to subscriber queues."""
+
+    def __init__(self, run_db, on_change=None):
+        self.run_db = run_db
+        self.on_change = on_change
+        self.subscribers = set()
+        self.last_id = None
+        self.conn = None
+        self.task = None
+
+    async def start(self):
+        self.conn = db.connect(readonly=True)
+        self.data_version = None
+        self.last_id = await self.run_db(self._max_id)
+        self.task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def _max_id(self):
+        return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM Measurements").fetchone()[0]
+
+    def _poll(self):
+        """New rows if another connection committed since the last poll, else None."""
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.data_version:
+            return None
+        self.data_version = version
+        rows = []
+        while True:
+            batch = fetch_rows_after(self.conn, self.last_id)
+            rows.extend(batch)
+            if len(batch) < RESUME_LIMIT:
+                return rows
+            self.last_id = batch[-1]["id"]
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            try:
+                rows = await self.run_db(self._poll)
+            except Exception as e:
+                metrics.log_event('stream_poll_failed', level='error', error=str(e))
+                continue
+            if rows is None:
+                continue
+            if self.on_change is not None:
+                self.on_change()
+            if not rows:
+                continue
+            self.last_id = rows[-1]["id"]
+            for queue in list(self.subscribers):
+                try:
+                    queue.put_nowait(rows)
+                except asyncio.QueueFull:
+                    # Too slow a client: close its stream, it will resume
+                    # from its last event id when it reconnects
+                    self.unsubscribe(queue)
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(None)
+
+
+def format_event(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def event_source(stream, since, types, is_disconnected):
+    """SSE body: replay rows after `since`, then send new rows as they come.
+
+    Each `measurements` event carries a list of rows and the id of its last
+    row, so a reconnecting EventSource resumes through Last-Event-ID.
+    """
+    queue = stream.subscribe()
+    try:
+        last_id = since if since is not None else stream.last_id
+        yield format_event("ready", {"cursor": last_id}, last_id)
+
+        if since is not None:
+            backlog = await stream.run_db(read_rows_after, since)
+            if backlog:
+                last_id = backlog[-1]["id"]
+                rows = [row for row in backlog if types is None or row["type"] in types]
+                if rows:
+                    yield format_event("measurements", rows, last_id)
+            if len(backlog) == RESUME_LIMIT:
+                # Too far behind: the client should reload the history
+                yield format_event("reset", {"cursor": stream.last_id})
+                return
+
+        while True:
+            try:
+                rows = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            if rows is None:
+                return
+            rows = [row for row in rows if row["id"] > last_id]
+            if not rows:
+                continue
+            last_id = rows[-1]["id"]
+            rows = [row for row in rows if types is None or row["type"] in types]
+            if rows:
+                yield format_event("measurements", rows, last_id)
+    finally:
+        stream.unsubscribe(queue)
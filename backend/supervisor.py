@@ -0,0 +1,188 @@
+"""Process supervisor of the backend container.
+
+Upgrades the database schema (creating `DB_PATH` from the `db.db` of the
+image when it does not exist yet), then runs each service as a child process:
+
+- `api`: uvicorn with `API_WORKERS` worker processes (default: one per CPU
+  this process may run on), sharing their metrics through `METRICS_DIR`;
+- `ingest`: `mqtt_adder.py` (extra arguments in `INGEST_ARGS`);
+- `retention`: `retention.py --loop`.
+
+`SERVICES` (default "api,ingest,retention") selects the services, so that
+they can also run in separate containers. A service that fails (non-zero
+exit code) is restarted after a delay doubling from 1 to 60 seconds; one that
+finishes its work, such as an ingest replaying a file, is not, and the
+supervisor exits once every service has finished. SIGTERM or Ctrl+C is
+forwarded to every service, which then has `SHUTDOWN_TIMEOUT` seconds to
+finish (the ingest writes its queued uplinks) before being killed.
+
+    python supervisor.py
+"""
+import math
+import os
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def available_cpus():
+    """CPUs this process may use: its affinity mask, capped by a cgroup v2 CPU quota (`docker run --cpus`)."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # Not available on macOS or Windows
+        cpus = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+SERVICES = [name for name in os.environ.get('SERVICES', 'api,ingest,retention').split(',') if name]
+API_HOST = os.environ.get('API_HOST', '0.0.0.0')
+API_PORT = os.environ.get('API_PORT', '8000')
+# The DuckDB copy can only be opened by one process
+API_WORKERS = 1 if os.environ.get('STORAGE_BACKEND') == 'duckdb' else \
+    int(os.environ.get('API_WORKERS') or available_cpus())
+DB_PATH = os.environ.get('DB_PATH', 'db.db')
+# Database shipped with the image, copied to an empty DB_PATH volume
+SEED_DB = 'db.db'
+INGEST_ARGS = shlex.split(os.environ.get('INGEST_ARGS', ''))
+SHUTDOWN_TIMEOUT = float(os.environ.get('SHUTDOWN_TIMEOUT', '30'))
+
+MIN_RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 60.0
+# A service that ran this long is considered healthy again
+STABLE_SECONDS = 60.0
+POLL_INTERVAL = 0.5
+
+
+def commands():
+    python = sys.executable
+    return {
+        'api': [python, '-m', 'uvicorn', 'server:app', '--host', API_HOST, '--port', API_PORT,
+                '--workers', str(API_WORKERS),
+                # Open event streams must not hold the shutdown past its deadline
+                '--timeout-graceful-shutdown', str(max(1, int(SHUTDOWN_TIMEOUT) - 5))],
+        'ingest': [python, 'mqtt_adder.py', *INGEST_ARGS],
+        'retention': [python, 'retention.py', '--loop'],
+    }
+
+
+def log(message):
+    print(f"[supervisor] {message}", flush=True)
+
+
+class Service:
+    def __init__(self, name, command, env=None):
+        self.name = name
+        self.command = command
+        self.env = env
+        self.process = None
+        self.started = None
+        self.finished = False
+        self.delay = MIN_RESTART_DELAY
+        self.restart_at = 0.0
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, env=self.env)
+        self.started = time.monotonic()
+        log(f"{self.name} started (pid {self.process.pid})")
+
+    def check(self, now):
+        """Restart the service once it has failed and its delay has passed."""
+        if self.finished:
+            return
+        if self.process is not None:
+            code = self.process.poll()
+            if code is None:
+                return
+            if code == 0:
+                log(f"{self.name} finished")
+                self.finished = True
+                return
+            if now - self.started >= STABLE_SECONDS:
+                self.delay = MIN_RESTART_DELAY
+            log(f"{self.name} exited with code {code}, restarting in {self.delay:.0f}s")
+            self.process = None
+            self.restart_at = now + self.delay
+            self.delay = min(self.delay * 2, MAX_RESTART_DELAY)
+        if now >= self.restart_at:
+            self.start()
+
+    def terminate(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def wait(self, deadline):
+        if self.process is None:
+            return
+        try:
+            self.process.wait(max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            log(f"{self.name} did not stop in {SHUTDOWN_TIMEOUT:.0f}s, killing it")
+            self.process.kill()
+            self.process.wait()
+        log(f"{self.name} stopped (code {self.process.returncode})")
+
+
+def main():
+    unknown = set(SERVICES) - set(commands())
+    if unknown:
+        raise SystemExit(f"Unknown services: {', '.join(sorted(unknown))}")
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+
+    if not os.path.exists(DB_PATH) and os.path.abspath(DB_PATH) != os.path.abspath(SEED_DB):
+        os.makedirs(os.path.dirname(os.path.abspath(DB_PATH)), exist_ok=True)
+        shutil.copyfile(SEED_DB, DB_PATH)
+        log(f"created {DB_PATH} from {SEED_DB}")
+    # Every service expects the current schema
+    code = subprocess.call([sys.executable, 'migrations.py', DB_PATH])
+    if code != 0:
+        raise SystemExit(code)
+
+    services = []
+    metrics_dir = None
+    for name in SERVICES:
+        env = None
+        if name == 'api' and API_WORKERS > 1 and not os.environ.get('METRICS_DIR'):
+            # Any worker answering /metrics renders those of all of them
+            metrics_dir = tempfile.mkdtemp(prefix='api-metrics-')
+            env = {**os.environ, 'METRICS_DIR': metrics_dir}
+        services.append(Service(name, commands()[name], env))
+    if 'api' in SERVICES:
+        log(f"api: {API_WORKERS} worker(s)")
+    for service in services:
+        service.start()
+    while not stopping:
+        now = time.monotonic()
+        for service in services:
+            service.check(now)
+        if all(service.finished for service in services):
+            log("every service finished")
+            break
+        time.sleep(POLL_INTERVAL)
+    else:
+        log("stopping")
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for service in services:
+            service.terminate()
+        for service in services:
+            service.wait(deadline)
+    if metrics_dir is not None:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
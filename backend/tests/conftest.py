@@ -0,0 +1,46 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+
+def migrated_copy(directory):
+    """Path of a migrated copy of the seed database in `directory`."""
+    path = str(directory / 'db.db')
+    shutil.copyfile(os.path.join(BACKEND, 'db.db'), path)
+    conn = db.connect(path)
+    migrations.migrate(conn)
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """Connection to a migrated copy of the seed database."""
+    conn = db.connect(migrated_copy(tmp_path))
+    yield conn
+    conn.close()
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    """API test client on a migrated copy of the seed database.
+
+    The server shuts its DB executor down on exit, so one client serves a
+    whole test module.
+    """
+    from fastapi.testclient import TestClient
+
+    path = migrated_copy(tmp_path_factory.mktemp('api'))
+    previous, db.DB_PATH = db.DB_PATH, path
+    import server
+    with TestClient(server.app) as client:
+        yield client
+    db.DB_PATH = previous
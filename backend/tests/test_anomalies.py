@@ -0,0 +1,28 @@
+from anomalies import SLOT_WIDTH, SLOTS, AnomalyDetector
+
+# 3:00 UTC on some day
+TS = 20000 * SLOT_WIDTH * SLOTS + 3 * SLOT_WIDTH
+
+
+def test_limit_with_negative_mean(conn):
+    # Devices 1 (temperature) and 2 (humidity) usually drop by 5 per reading
+    # at 3:00: learned band 5 around a mean of -5
+    c = conn.cursor()
+    c.execute("BEGIN")
+    for device in (1, 2):
+        c.execute("INSERT OR REPLACE INTO AnomalyState (device, value, measurement) VALUES (?, 20.0, 0)", (device,))
+        c.execute("INSERT INTO AnomalyModel (device, slot, count, mean, variance) VALUES (?, 3, 100, -5.0, 1.0)",
+                  (device,))
+    c.executemany(
+        "INSERT INTO Measurements (device, value, recorded_ts) VALUES (?, ?, ?)",
+        [(1, 8.0, TS), (2, 21.0, TS)],
+    )
+    assert AnomalyDetector().catch_up(c) == 2
+    conn.commit()
+
+    rows = {row["device"]: (row["difference"], row["threshold"])
+            for row in conn.execute("SELECT device, difference, threshold FROM Anomalies")}
+    # A drop of 12 is past the largest normal drop, 10
+    assert rows[1] == (12.0, 10.0)
+    # Any rise is abnormal: the largest normal one is 0
+    assert rows[2] == (1.0, 0.0)
@@ -0,0 +1,26 @@
+def test_summary(client):
+    response = client.get("/summary")
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body) == {"latest", "devices", "errors"}
+    assert body["latest"]["co2"]["value"] is not None
+    assert set(body["errors"]) == {"total", "unhandled", "occurrences"}
+
+
+def test_device_health(client):
+    response = client.get("/devices/health")
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body) == {"stations", "devices"}
+    station = next(station for station in body["stations"] if station["station"] == "captor-controller")
+    assert station["status"] in ("ok", "degraded", "down", "unknown")
+    assert station["battery"]["device"] == 11
+    assert {device["device"] for device in body["devices"]} >= {1, 8, 11}
+    assert all(device["readings"] > 0 for device in body["devices"] if device["device"] != 9)
+
+
+def test_legacy_series_keep_type_keys(client):
+    response = client.get("/luminosity")
+    assert response.status_code == 200
+    points = response.json()["luminosity"]
+    assert points and set(points[0]) == {"value", "recorded_at"}
@@ -0,0 +1,27 @@
+import errors
+
+
+def error_ids(conn, where="1"):
+    return [row[0] for row in conn.execute(f"SELECT id FROM Errors WHERE {where} ORDER BY id")]
+
+
+def test_set_handled_ids_and_filters(conn):
+    # Only the listed errors that match the filters
+    device_11 = error_ids(conn, "device = 11")
+    device_10 = error_ids(conn, "device = 10")
+    where, params = errors.error_filters(device=11)
+    c = conn.cursor()
+    c.execute("BEGIN")
+    assert errors.set_handled(c, True, device_11[:1] + device_10, where, params) == 1
+    conn.commit()
+    assert error_ids(conn, "handled") == device_11[:1]
+
+
+def test_set_handled_filters_only(conn):
+    device_10 = error_ids(conn, "device = 10")
+    where, params = errors.error_filters(device=10)
+    c = conn.cursor()
+    c.execute("BEGIN")
+    assert errors.set_handled(c, True, None, where, params) == len(device_10)
+    conn.commit()
+    assert error_ids(conn, "handled") == device_10
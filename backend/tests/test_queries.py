@@ -0,0 +1,52 @@
+from datetime import datetime, timezone
+
+import rollups
+from queries import query_measurements
+
+# 2025-04-02 12:00 UTC, after the readings of the seed station
+TS = 1743595200
+
+
+def add_station(conn):
+    """Second station with a CO2 sensor reading 1000 ppm; returns its device id."""
+    c = conn.cursor()
+    c.execute("BEGIN")
+    device = c.execute(
+        "INSERT INTO Device (type, station, sensor_key) VALUES ('co2', 'station-2', 'co2') RETURNING id"
+    ).fetchone()[0]
+    c.executemany("INSERT INTO Measurements (device, value, recorded_ts) VALUES (?, 1000, ?)",
+                  [(device, TS + i * 60) for i in range(3)])
+    rollups.catch_up(c)
+    conn.commit()
+    return device
+
+
+def test_stations_are_not_mixed(conn):
+    device = add_station(conn)
+    seed = [row[0] for row in conn.execute("SELECT value FROM Measurements WHERE device = 8 ORDER BY recorded_ts")]
+
+    series = query_measurements(conn, ['co2'], time_format='epoch_ms')
+    assert list(series) == ['co2:8', f'co2:{device}']
+    assert series['co2:8']['v'] == seed
+    assert series[f'co2:{device}']['v'] == [1000] * 3
+
+    daily = query_measurements(conn, ['co2'], bucket='1d', time_format='epoch_ms')
+    assert daily[f'co2:{device}']['v'] == [1000]
+    assert 1000 not in daily['co2:8']['v']
+
+    assert query_measurements(conn, ['co2'], station='station-2', bucket='1d')['co2']['v'] == [1000]
+    assert query_measurements(conn, ['co2'], device=8)['co2']['v'] == seed
+    assert query_measurements(conn, ['co2', 'battery'], station='station-2')['battery'] == {"t": [], "v": []}
+
+
+def test_devices_without_data_get_no_series(conn):
+    # Device 9, a luminosity sensor without station, has no measurements
+    series = query_measurements(conn, ['luminosity', 'co2'])
+    assert list(series) == ['luminosity', 'co2']
+    assert series['luminosity']['v']
+
+    # Devices without data in the range do not split the series either
+    device = add_station(conn)
+    assert list(query_measurements(conn, ['co2'], start=datetime.fromtimestamp(TS, timezone.utc))) == ['co2']
+    assert list(query_measurements(conn, ['co2'], end=datetime.fromtimestamp(TS - 1, timezone.utc))) == ['co2']
+    assert list(query_measurements(conn, ['co2'])) == ['co2:8', f'co2:{device}']
@@ -0,0 +1,79 @@
+"""Timestamp conversions between the UTC values stored by SQLite and the
+dashboard timezone.
+
+Conversions work on whole columns: the timezone object is built once, and its
+UTC offset is computed once per hour of data (DST transitions always happen on
+the hour), so converting a series costs one cheap formatting call per row.
+"""
+import time
+from datetime import datetime
+
+import pytz
+
+DEFAULT_TIMEZONE = 'Europe/Paris'
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_timezones = {}
+_offsets = {}
+
+
+def get_timezone(name):
+    tz = _timezones.get(name)
+    if tz is None:
+        tz = _timezones[name] = pytz.timezone(name)
+    return tz
+
+
+def format_epochs(epochs, target_timezone=DEFAULT_TIMEZONE):
+    """Format a column of UTC epoch seconds as local timestamp strings."""
+    tz = get_timezone(target_timezone)
+    offsets = _offsets.setdefault(target_timezone, {})
+    strftime, gmtime = time.strftime, time.gmtime
+    result = []
+    for ts in epochs:
+        hour = ts // 3600
+        offset = offsets.get(hour)
+        if offset is None:
+            offset = offsets[hour] = int(datetime.fromtimestamp(hour * 3600, tz).utcoffset().total_seconds())
+        result.append(strftime(TIMESTAMP_FORMAT, gmtime(ts + offset)))
+    return result
+
+
+def parse_utc(timestamp_str):
+    """Epoch seconds of a naive UTC 'YYYY-MM-DD HH:MM:SS' SQLite timestamp."""
+    return int(datetime.fromisoformat(timestamp_str).replace(tzinfo=pytz.UTC).timestamp())
+
+
+def convert_timestamps(timestamp_strs, target_timezone=DEFAULT_TIMEZONE):
+    """Convert a column of SQLite timestamp strings to the target timezone.
+
+    Values that cannot be parsed are returned unchanged.
+    """
+    epochs = []
+    invalid = {}
+    for i, timestamp_str in enumerate(timestamp_strs):
+        try:
+            epochs.append(parse_utc(timestamp_str))
+        except (TypeError, ValueError):
+            epochs.append(0)
+            invalid[i] = timestamp_str
+    result = format_epochs(epochs, target_timezone)
+    for i, timestamp_str in invalid.items():
+        result[i] = timestamp_str
+    return result
+
+
+def convert_timestamp(timestamp_str, target_timezone=DEFAULT_TIMEZONE):
+    """Convert a timestamp string to the target timezone."""
+    return convert_timestamps([timestamp_str], target_timezone)[0]
+
+
+def to_epoch(dt, source_timezone=DEFAULT_TIMEZONE):
+    """Convert a datetime to epoch seconds, as stored in `recorded_ts`.
+
+    Naive datetimes are interpreted in the dashboard timezone, the same one
+    used for the timestamps returned by the API.
+    """
+    if dt.tzinfo is None:
+        dt = get_timezone(source_timezone).localize(dt)
+    return int(dt.timestamp())
@@ -8,11 +8,34 @@ interface Error {
   device: string;
   error: string;
   handled: boolean;
+  occurrences: number;
   recorded_at: string;
+  last_seen: string;
 }
 
-async function getErrors() {
-  const res = await axios.get(`${process.env.NEXT_PUBLIC_API_URL}/errors`);
+interface ErrorPage {
+  items: Error[];
+  next_cursor: number | null;
+  total: number;
+}
+
+// Position of a list in the paginated /errors results
+interface ListState {
+  nextCursor: number | null;
+  total: number;
+}
+
+const PAGE_SIZE = 500;
+
+// One page of the active or resolved errors, newest first
+async function getErrorPage(handled: boolean, cursor: number | null = null): Promise<ErrorPage> {
+  const params = cursor === null ? { handled, limit: PAGE_SIZE } : { handled, limit: PAGE_SIZE, cursor };
+  const res = await axios.get(`${process.env.NEXT_PUBLIC_API_URL}/errors`, { params });
+  return res.data;
+}
+
+async function resolveAllErrors() {
+  const res = await axios.patch(`${process.env.NEXT_PUBLIC_API_URL}/errors`, { handled: true }, { params: { handled: false } });
   return res.data;
 }
 
@@ -23,21 +46,46 @@ async function toggleError(id: number) {
 
 export default function ErrorsPage() {
   const [errors, setErrors] = useState<Error[]>([]);
+  const [lists, setLists] = useState<Record<'active' | 'resolved', ListState>>({
+    active: { nextCursor: null, total: 0 },
+    resolved: { nextCursor: null, total: 0 },
+  });
   const [isLoading, setIsLoading] = useState(true);
 
   useEffect(() => {
     fetchErrors();
   }, []); 
 
+  // First page of both lists
   async function fetchErrors() {
     try {
-      const data = await getErrors();
-      setErrors(data);
+      const [active, resolved] = await Promise.all([getErrorPage(false), getErrorPage(true)]);
+      setErrors([...active.items, ...resolved.items]);
+      setLists({
+        active: { nextCursor: active.next_cursor, total: active.total },
+        resolved: { nextCursor: resolved.next_cursor, total: resolved.total },
+      });
     } finally {
       setIsLoading(false);
     }
   }
 
+  // Next page of one list, appended to the errors already shown
+  async function loadMore(list: 'active' | 'resolved') {
+    const { nextCursor } = lists[list];
+    if (nextCursor === null) return;
+    try {
+      const page = await getErrorPage(list === 'resolved', nextCursor);
+      setErrors(currentErrors => {
+        const shown = new Set(currentErrors.map(err => err.id));
+        return [...currentErrors, ...page.items.filter(err => !shown.has(err.id))];
+      });
+      setLists(current => ({ ...current, [list]: { nextCursor: page.next_cursor, total: page.total } }));
+    } catch (error) {
+      console.error('Failed to load more errors:', error);
+    }
+  }
+
   const unhandledErrors = errors.filter(error => !error.handled);
   const handledErrors = errors.filter(error => error.handled);
 
@@ -48,6 +96,13 @@ export default function ErrorsPage() {
           err.id === error.id ? { ...err, handled: !err.handled } : err
         )
       );
+      // The error moves from one list to the other
+      const [from, to] = error.handled ? ['resolved', 'active'] as const : ['active', 'resolved'] as const;
+      setLists(current => ({
+        ...current,
+        [from]: { ...current[from], total: current[from].total - 1 },
+        [to]: { ...current[to], total: current[to].total + 1 },
+      }));
 
       const updatedError = await toggleError(error.id);
 
@@ -62,6 +117,15 @@ export default function ErrorsPage() {
     }
   }
 
+  async function handleResolveAll() {
+    try {
+      await resolveAllErrors();
+    } catch (error) {
+      console.error('Failed to resolve errors:', error);
+    }
+    await fetchErrors();
+  }
+
   if (isLoading) {
     return (
       <div className="p-4 md:p-8">
@@ -83,14 +147,26 @@ export default function ErrorsPage() {
       
       <div className="space-y-6">
         <div>
-          <h2 className="text-lg md:text-xl font-semibold mb-3 text-red-600">Active Errors</h2>
+          <div className="flex items-center justify-between mb-3">
+            <h2 className="text-lg md:text-xl font-semibold text-red-600">Active Errors</h2>
+            {unhandledErrors.length > 0 && (
+              <button
+                onClick={handleResolveAll}
+                className="text-xs sm:text-sm px-2 sm:px-3 py-1 rounded-md font-medium bg-green-100 text-green-800 hover:bg-green-200"
+              >
+                Resolve all
+              </button>
+            )}
+          </div>
           <ErrorTable errors={unhandledErrors} onToggle={handleToggle} />
+          <MoreErrors shown={unhandledErrors.length} list={lists.active} onLoadMore={() => loadMore('active')} />
         </div>
 
         {handledErrors.length > 0 && (
           <div>
             <h2 className="text-lg md:text-xl font-semibold mb-3 text-green-600">Resolved Errors</h2>
             <ErrorTable errors={handledErrors} onToggle={handleToggle} />
+            <MoreErrors shown={handledErrors.length} list={lists.resolved} onLoadMore={() => loadMore('resolved')} />
           </div>
         )}
       </div>
@@ -98,6 +174,24 @@ export default function ErrorsPage() {
   );
 }
 
+// Count of the errors not loaded yet, with a button fetching the next page
+function MoreErrors({ shown, list, onLoadMore }: { shown: number, list: ListState, onLoadMore: () => Promise<void> }) {
+  if (list.nextCursor === null) {
+    return null;
+  }
+  return (
+    <div className="flex items-center justify-between mt-3 text-sm text-gray-600">
+      <span>Showing {shown} of {list.total} errors</span>
+      <button
+        onClick={onLoadMore}
+        className="text-xs sm:text-sm px-2 sm:px-3 py-1 rounded-md font-medium bg-slate-100 text-slate-800 hover:bg-slate-200"
+      >
+        Load more
+      </button>
+    </div>
+  );
+}
+
 function ErrorTable({ errors, onToggle }: { errors: Error[], onToggle: (error: Error) => Promise<void> }) {
   return (
     <div className="rounded-md border overflow-x-auto">
@@ -116,14 +210,19 @@ function ErrorTable({ errors, onToggle }: { errors: Error[], onToggle: (error: E
               <td className="p-3 text-sm text-gray-900 whitespace-nowrap">{error.device}</td>
               <td className="p-3 text-sm text-gray-900 whitespace-pre-wrap break-words">
                 <div className="flex flex-col">
-                  <span>{error.error}</span>
+                  <span>
+                    {error.error}
+                    {error.occurrences > 1 && (
+                      <span className="ml-2 text-xs text-gray-500">×{error.occurrences}</span>
+                    )}
+                  </span>
                   <span className="text-xs text-gray-500 sm:hidden mt-1">
-                    {new Date(error.recorded_at).toLocaleString()}
+                    {new Date(error.last_seen).toLocaleString()}
                   </span>
                 </div>
               </td>
               <td className="p-3 text-sm text-gray-900 whitespace-nowrap hidden sm:table-cell">
-                {new Date(error.recorded_at).toLocaleString()}
+                {new Date(error.last_seen).toLocaleString()}
               </td>
               <td className="p-3 text-sm whitespace-nowrap">
                 <button 
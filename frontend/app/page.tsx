@@ -1,8 +1,7 @@
 "use client";
 
 import { useState, useEffect } from "react";
-import axios from "axios";
-import { getWeatherData, getBatteryData } from "@/lib/api";
+import { getWeatherData, getSummary } from "@/lib/api";
 import { Card } from "@/components/ui/card";
 import Link from "next/link";
 import {
@@ -78,81 +77,36 @@ export default function Home() {
   useEffect(() => {
     async function fetchDashboardData() {
       try {
-        // Fetch temperature & humidity data
-        const tempHumidityRes = await axios.get(
-          `${process.env.NEXT_PUBLIC_API_URL}/temperatures-humidity`
-        );
-        if (tempHumidityRes.data) {
-          const tempData = tempHumidityRes.data.temperature;
-          const humidityData = tempHumidityRes.data.humidity;
-
-          setTempHumidity({
-            temperature: tempData[tempData.length - 1]?.value ?? 0,
-            humidity: humidityData[humidityData.length - 1]?.value ?? 0,
-            lastUpdated: tempData[tempData.length - 1]?.recorded_at ?? null,
-          });
-        }
+        // Current readings and error counts in one request
+        const summary = await getSummary();
+        const latest = summary.latest;
+        const valueOf = (type: string) => latest[type]?.value ?? 0;
+
+        setTempHumidity({
+          temperature: valueOf("temperature"),
+          humidity: valueOf("humidity"),
+          lastUpdated: latest.temperature?.recorded_at ?? null,
+        });
 
-        // Fetch soil data
-        const soilHumidityRes = await axios.get(
-          `${process.env.NEXT_PUBLIC_API_URL}/soil-humidity`
-        );
-        const soilTempRes = await axios.get(
-          `${process.env.NEXT_PUBLIC_API_URL}/temperaturesol`
-        );
-
-        if (soilHumidityRes.data && soilTempRes.data) {
-          const humidity10 = soilHumidityRes.data.humidity10;
-          const humidity20 = soilHumidityRes.data.humidity20;
-          const humidity30 = soilHumidityRes.data.humidity30;
-          const soilTemp = soilTempRes.data.temperaturesol;
-
-          setSoilData({
-            humidity10: humidity10[humidity10.length - 1]?.value ?? 0,
-            humidity20: humidity20[humidity20.length - 1]?.value ?? 0,
-            humidity30: humidity30[humidity30.length - 1]?.value ?? 0,
-            soilTemp: soilTemp[soilTemp.length - 1]?.value ?? 0,
-            lastUpdated: humidity10[humidity10.length - 1]?.recorded_at ?? null,
-          });
-        }
+        setSoilData({
+          humidity10: valueOf("humidity10"),
+          humidity20: valueOf("humidity20"),
+          humidity30: valueOf("humidity30"),
+          soilTemp: valueOf("temperaturesol"),
+          lastUpdated: latest.humidity10?.recorded_at ?? null,
+        });
 
-        // Fetch plant suitability data
-        const co2Res = await axios.get(
-          `${process.env.NEXT_PUBLIC_API_URL}/co2`
-        );
-        const luminosityRes = await axios.get(
-          `${process.env.NEXT_PUBLIC_API_URL}/luminosity`
-        );
-        const pressureRes = await axios.get(
-          `${process.env.NEXT_PUBLIC_API_URL}/pressure`
-        );
-
-        if (co2Res.data && luminosityRes.data && pressureRes.data) {
-          const co2Data = co2Res.data.co2;
-          const luminosityData = luminosityRes.data.luminosity;
-          const pressureData = pressureRes.data.pressure;
-
-          setPlantData({
-            co2: co2Data[co2Data.length - 1]?.value ?? 0,
-            luminosity: luminosityData[luminosityData.length - 1]?.value ?? 0,
-            pressure: pressureData[pressureData.length - 1]?.value ?? 0,
-            lastUpdated: co2Data[co2Data.length - 1]?.recorded_at ?? null,
-          });
-        }
+        setPlantData({
+          co2: valueOf("co2"),
+          luminosity: valueOf("luminosity"),
+          pressure: valueOf("pressure"),
+          lastUpdated: latest.co2?.recorded_at ?? null,
+        });
 
-        // Fetch error count
-        const errorsRes = await axios.get(
-          `${process.env.NEXT_PUBLIC_API_URL}/errors`
-        );
-        if (errorsRes.data) {
-          const activeErrors = errorsRes.data.filter(
-            (error: any) => !error.handled
-          ).length;
-          setErrorCount({
-            total: errorsRes.data.length,
-            active: activeErrors,
-          });
-        }
+        setErrorCount({
+          total: summary.errors.total,
+          active: summary.errors.unhandled,
+        });
 
         // Fetch weather data
         const weatherData = await getWeatherData();
@@ -161,10 +115,8 @@ export default function Home() {
           precipitation: weatherData.precipitation * 100, // Convert to percentage
         });
 
-        // Fetch battery data
-        const batteryData = await getBatteryData();
-        if (batteryData) {
-          setBattery(batteryData.value);
+        if (latest.battery) {
+          setBattery(latest.battery.value);
         }
       } catch (error) {
         console.error("Error fetching dashboard data:", error);
@@ -46,27 +46,104 @@ export async function getWeatherData(latitude = 48.8567, longitude = 2.3508): Pr
   }
 }
 
+// Latest reading of a device, as returned by /summary
+export interface LatestValue {
+  device: number;
+  type: string;
+  station: string | null;
+  value: number;
+  recorded_at: string;
+}
+
+export interface Summary {
+  latest: Record<string, LatestValue>;
+  devices: LatestValue[];
+  errors: { total: number; unhandled: number; occurrences: number };
+}
+
+/**
+ * Fetches the current readings and error counts from backend API
+ * @returns Promise with the summary
+ */
+export async function getSummary(): Promise<Summary> {
+  const response = await axios.get(`${process.env.NEXT_PUBLIC_API_URL}/summary`);
+  return response.data;
+}
+
 /**
  * Fetches battery data from backend API
  * @returns Promise with battery data
  */
 export async function getBatteryData(): Promise<BatteryData | null> {
   try {
-    const response = await axios.get(`${process.env.NEXT_PUBLIC_API_URL}/battery`);
-    const batteryData = response.data.battery;
-    
-    // Return the latest battery measurement if available
-    if (batteryData && batteryData.length > 0) {
-      return batteryData[batteryData.length - 1];
-    }
-    
-    return null;
+    const summary = await getSummary();
+    // Latest battery measurement, if any
+    return summary.latest.battery ?? null;
   } catch (error) {
     console.error('Error fetching battery data:', error);
     return null;
   }
 }
 
+// Columnar series: timestamps in epoch ms and values
+export interface Series {
+  t: number[];
+  v: number[];
+}
+
+export const SERIES_MEDIA_TYPE = 'application/vnd.iot.series';
+
+/**
+ * Decodes the binary series layout sent by the backend for SERIES_MEDIA_TYPE
+ * @param buffer - Response body
+ * @returns Series keyed by device type
+ */
+export function decodeSeries(buffer: ArrayBuffer): Record<string, Series> {
+  const view = new DataView(buffer);
+  const decoder = new TextDecoder();
+  const series: Record<string, Series> = {};
+  let offset = 4; // "IOTS"
+  const count = view.getUint16(offset, true);
+  offset += 2;
+  for (let i = 0; i < count; i++) {
+    const nameLength = view.getUint8(offset);
+    offset += 1;
+    const name = decoder.decode(new Uint8Array(buffer, offset, nameLength));
+    offset += nameLength;
+    const points = view.getUint32(offset, true);
+    offset += 4;
+    const t = new Array<number>(points);
+    let timestamp = 0;
+    for (let j = 0; j < points; j++) {
+      timestamp += Number(view.getBigInt64(offset, true));
+      t[j] = timestamp;
+      offset += 8;
+    }
+    const v = new Array<number>(points);
+    for (let j = 0; j < points; j++) {
+      v[j] = view.getFloat32(offset, true);
+      offset += 4;
+    }
+    series[name] = { t, v };
+  }
+  return series;
+}
+
+/**
+ * Fetches several series at once in the compact binary layout
+ * @param types - Device types
+ * @param params - Extra query parameters (from, to, bucket, ...)
+ * @returns Promise with series keyed by device type
+ */
+export async function getSeries(types: string[], params: Record<string, string> = {}): Promise<Record<string, Series>> {
+  const response = await axios.get(`${process.env.NEXT_PUBLIC_API_URL}/measurements`, {
+    params: { ...params, types: types.join(',') },
+    headers: { Accept: SERIES_MEDIA_TYPE },
+    responseType: 'arraybuffer'
+  });
+  return decodeSeries(response.data);
+}
+
 /**
  * Maps WMO weather codes to human-readable descriptions
  * @param code - WMO weather code